@@ -11,7 +11,7 @@ import discord as discord
 import math
 from discord.ext import commands
 
-from python import articlesearch
+from python import articlesearch, cache
 
 logger = logging.getLogger("galnet_discord")
 logger.setLevel(logging.INFO)
@@ -52,6 +52,12 @@ with open("BotSettings.json") as settings_file:
 
 bot = commands.Bot(command_prefix=settings["PREFIX"], case_insensitive=True, help_command=None)
 
+# Rendered article embeds, by article ID. Articles don't change once they are published.
+# upgrade.py renumbers the IDs of articles, so the bot must be restarted after running it.
+EMBED_CACHE_SIZE = 500
+EMBED_CACHE_WARM = 50
+embed_cache = cache.LRUCache(max_size=EMBED_CACHE_SIZE)
+
 
 @bot.event
 async def on_command_error(ctx, error):
@@ -124,6 +130,16 @@ async def on_ready():
     else:
         await bot.change_presence(activity=discord.Game(name=f"{settings['PREFIX']}help"))
 
+    # on_ready runs again after reconnecting, but the index is only built once
+    if (await articlesearch.get_settings()).inverted_index and articlesearch.get_index() is None:
+        index = await articlesearch.build_index()
+        print(f"Search index built with {len(index)} articles")
+
+    # The newest articles are the most read
+    if not embed_cache:
+        for row in await articlesearch.latest(EMBED_CACHE_WARM):
+            await command_read(0, [row])
+
 
 @bot.command()
 async def ping(ctx):
@@ -140,20 +156,28 @@ async def stop(ctx):
         await bot.get_user(int(settings["Maintainer-ID"])).send("Bot has been turned off by: {}".format(ctx.author))
 
     finally:
+        await articlesearch.shutdown()
         await bot.close()
 
 
+@bot.command()
+@commands.is_owner()
+async def stats(ctx):
+    lines = []
+    for name, stats in (("Search cache", (await articlesearch.get_search_cache()).stats()),
+                        ("Embed cache", embed_cache.stats())):
+        lines.append(f"{name}: {stats['size']} / {stats['max_size']} entries,"
+                     f" {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+    await ctx.send("\n".join(lines))
+
+
 @bot.command()
 async def search(ctx, *, terms):
     temp_msg = await ctx.send("Searching")
-    results = await articlesearch.search(terms)
+    # Pages are fetched when they are shown
+    page = await articlesearch.search_page(terms, page_size=8)
     final = {}
-    embeds = math.floor(len(results[0]) / 8)
-    if len(results[0]) % 8:
-        embeds += 1
-    if embeds == 0 and results[1] > 0:
-        embeds = 1
-    current_embed = 1
+    embeds = math.ceil(page.total / 8)
     numbers = ["\u0031\u20E3",
                "\u0032\u20E3",
                "\u0033\u20E3",
@@ -162,35 +186,34 @@ async def search(ctx, *, terms):
                "\u0036\u20E3",
                "\u0037\u20E3",
                "\u0038\u20E3"]
-    start = 0
-    end = 8
     await temp_msg.delete()
-    if results[1] == 0:
+    if page.total == 0:
         await ctx.send("No results match your query")
         return
     cont = True
     while cont:
         embed = discord.Embed(
-            title=f"Here are your search results | Page {current_embed} / {embeds}",
+            title=f"Here are your search results | Page {page.start // 8 + 1} / {embeds}",
             color=discord.Color.orange()
         )
-        embed.set_footer(text=f"{results[1]} Results Found")
+        embed.set_footer(text=f"{page.matches} Results Found")
         embed.add_field(name="Key", value="ID | Title | Date Released", inline=False)
         i = 1
-        for row in results[0][start:end]:
+        for row in page.rows:
+            date_released = articlesearch.game_date(row['dateReleased'])
             embed.add_field(name=f"Option {i}", value=f"{row['ID']} | {row['Title']} | "
-                                                      f"{row['dateReleased'].strftime('%d %b %Y')}", inline=False)
+                                                      f"{date_released.strftime('%d %b %Y')}", inline=False)
             final[i] = row['ID']
             i += 1
         message = await ctx.send(embed=embed)
         ids = {ctx.message.id: message.id}
         number = 0
-        if current_embed > 1:
+        if page.previous:
             await message.add_reaction("\u23EA")
-        while number < len(results[0][start:end]):
+        while number < len(page.rows):
             await message.add_reaction(numbers[number])
             number += 1
-        if current_embed < embeds:
+        if page.next:
             await message.add_reaction("\u23E9")
 
         def check(payload):
@@ -210,14 +233,10 @@ async def search(ctx, *, terms):
             reaction = await bot.wait_for("raw_reaction_add", timeout=120.0, check=check)
             if reaction.emoji.name == "\u23E9":
                 await message.delete()
-                current_embed += 1
-                start += 8
-                end += 8
+                page = await articlesearch.search_page(terms, page.next, page_size=8)
             elif reaction.emoji.name == "\u23EA":
                 await message.delete()
-                current_embed -= 1
-                start -= 8
-                end -= 8
+                page = await articlesearch.search_page(terms, page.previous, page_size=8)
             elif reaction.emoji.name in numbers:
                 result = await command_read(final[numbers.index(reaction.emoji.name) + 1])
                 await ctx.send(embed=result[0])
@@ -282,21 +301,21 @@ async def command_update():
                             for line in lines:
                                 if line != channelid:
                                     newslist.write(line)
-            for article in article_uids:
-                row = await articlesearch.read(uid=article)
+            # Every new article is read with one query, and rendered once for all channels
+            for row in await articlesearch.read_many(uids=article_uids):
+                embed = await command_read(0, [row])
 
                 file.seek(0)
                 for channelid in file.readlines():
                     try:
-                        embed = await command_read(0, row)
                         try:
                             await bot.get_channel(int(channelid)).send(embed=embed[0])
                         except discord.HTTPException as e:
                             import datetime
                             await bot.get_user(int(settings["Maintainer-ID"])).send(
                                 "Error updating news base. Message too long, could not fix `CS{}-{}`"
-                                " .\nText: {}. \nCode: {}."
-                            ).format(datetime.datetime.now().strftime('%d%m%y%H%M'), article, e.text, e.code)
+                                " .\nText: {}. \nCode: {}.".format(datetime.datetime.now().strftime('%d%m%y%H%M'),
+                                                                   row["UID"], e.text, e.code))
                     except AttributeError:
                         pass
 
@@ -324,6 +343,9 @@ async def read(ctx, articleid: int):
 
 async def command_read(articleid: int, command_up: tuple = False):
     if not command_up:
+        cached = embed_cache.get(int(articleid))
+        if cached is not None:
+            return [discord.Embed.from_dict(cached[0]), cached[1]]
         row = await articlesearch.read(articleid)
     else:
         row = command_up
@@ -376,6 +398,7 @@ async def command_read(articleid: int, command_up: tuple = False):
         color=discord.Color.orange()
     )
     embed.set_footer(text=footer)
+    embed_cache.put(row["ID"], (embed.to_dict(), row["UID"]))
     return [embed, row["UID"]]
 
 
@@ -442,7 +465,10 @@ async def help(ctx, command: str = None):
                 title="Search",
                 description="Searches the database based on the given options. "
                             "You can read any result by clicking the matching ID below the result, "
-                            "or by using the `read` command.",
+                            "or by using the `read` command. Terms can be combined with AND, OR and NOT, "
+                            "\"exact phrases\", (groups), and title: or content: prefixes. "
+                            "`thargoid -azimuth` finds articles with thargoid but without azimuth, while "
+                            "`thargoid OR NOT azimuth` also finds every article without azimuth.",
                 color=discord.Color.orange()
             )
             embed.add_field(name="Format", value="search --options keywords", inline=False)
@@ -452,7 +478,9 @@ A full list is [available here.](https://github.com/HassanAbouelela/Galnet-Newsf
 - title: Searches only in the titles of the articles (default search mode)
 - content: Searches only in the content of an article, and ignores the title
 - searchall: Searches both title and content of an article
+- substring: Matches the terms anywhere inside words, instead of matching whole words
 - searchreverse: Searches the DB from the oldest article
+- rank: Shows the most relevant results first
 - limit: Returns only the latest results up to number given (default 5). Format: limit=XYZ
 - limitall: Returns all results found
 - before: Looks for articles that were written before a given date. Format: YYYY-MM-DD
@@ -1,17 +1,45 @@
 #  Copyright (c) 2020 Hassan Abouelela
 #  Licensed under the MIT License
 
+import asyncio
+import base64
+import dataclasses
 import datetime
 import json
 import os
-import re
-from urllib.parse import unquote
+import typing
 
 import aiohttp
 import asyncpg
-from bs4 import BeautifulSoup as Bs4
 
-GAME_YEAR_OFFSET = 1286
+from python import cache, crawler, extractor, invertedindex, pipeline, querylang
+
+GAME_YEAR_OFFSET = extractor.GAME_YEAR_OFFSET
+ARTICLE_COLUMNS = ("Title", "UID", "dateReleased", "dateAdded", "Text")
+# The columns of an article that are read, without the search vector
+_READ_COLUMNS = ", ".join(f'"{column}"' for column in ("ID",) + ARTICLE_COLUMNS)
+# Number of rows read at a time by search
+CURSOR_PREFETCH = 100
+# Weights of ts_rank for the D, C, B (content) and A (title) labels of the search vector
+RANK_WEIGHTS = "0.1, 0.2, 0.2, 1.0"
+# Number of query words whose lexemes are kept in memory
+LEXEME_CACHE_SIZE = 10000
+# The columns of the in-memory index. Title words have the weight A in the search vector, and content words B.
+_INDEX_COLUMNS = ('"ID", "dateReleased",'
+                  ' ARRAY(SELECT lexeme FROM unnest("searchVector") WHERE \'A\' = ANY(weights)) AS "titleLexemes",'
+                  ' ARRAY(SELECT lexeme FROM unnest("searchVector") WHERE \'B\' = ANY(weights)) AS "textLexemes"')
+
+_pool = None
+_settings_cache = None
+_pool_lock = asyncio.Lock()
+_page_cache = crawler.PageCache()
+_parser = None
+_search_cache = None
+_index = None
+# Lexemes of query words, as the english text search configuration finds them (See _lexemes)
+_lexeme_cache = cache.LRUCache(max_size=LEXEME_CACHE_SIZE)
+# Held while the index is built, and while update() adds articles, so none are left out of the index
+_index_lock = asyncio.Lock()
 
 
 async def upgrade():
@@ -34,7 +62,36 @@ async def upgrade():
         json.dump(new_settings, settings_file, indent=2)
 
 
-async def fetch_settings():
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """Typed view of the database settings stored in Settings.json."""
+    host: str = "localhost"
+    database: str = "postgres"
+    table: str = "Articles"
+    user: str = "postgres"
+    passfile: typing.Optional[str] = None
+    password: typing.Optional[str] = None
+    ssl: bool = False
+    port: typing.Optional[int] = None
+    pool_min_size: int = 1
+    pool_max_size: int = 10
+    batch_size: int = 500
+    parser_executor: str = "process"
+    parser_workers: typing.Optional[int] = None
+    base_url: str = crawler.BASE_URL
+    search_cache_size: int = 256
+    search_cache_ttl: typing.Optional[float] = 300
+    inverted_index: bool = False
+
+    @classmethod
+    def from_dict(cls, raw: dict):
+        return cls(**{field.name: raw[field.name] for field in dataclasses.fields(cls) if field.name in raw})
+
+
+async def _load_settings():
+    """Returns the cached settings dictionary, reloading it only when Settings.json changes on disk."""
+    global _settings_cache
+
     if not os.path.exists("Settings.json"):
         async with aiohttp.ClientSession() as settings_session:
             async with settings_session.get(
@@ -45,8 +102,25 @@ async def fetch_settings():
 
         with open("Settings.json", "w+") as file:
             json.dump(raw_json, file, indent=2)
-    with open("Settings.json") as file:
-        return json.load(file)
+
+    stat = os.stat("Settings.json")
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if _settings_cache is None or _settings_cache[0] != signature:
+        with open("Settings.json") as file:
+            raw = json.load(file)
+        _settings_cache = (signature, raw, Settings.from_dict(raw))
+
+    return _settings_cache
+
+
+async def fetch_settings():
+    """Returns a copy of the raw settings dictionary."""
+    return dict((await _load_settings())[1])
+
+
+async def get_settings() -> Settings:
+    """Returns the current database settings."""
+    return (await _load_settings())[2]
 
 
 async def connect(host: str = "localhost", database: str = "postgres", user: str = "postgres",
@@ -54,226 +128,677 @@ async def connect(host: str = "localhost", database: str = "postgres", user: str
     """Connects to a database"""
     if use_file:
         # Load Settings
-        settings = await fetch_settings()
+        settings = await get_settings()
 
-        host = settings["host"]
-        database = settings["database"]
-        user = settings["user"]
-        passfile = settings["passfile"]
-        password = settings["password"]
-        ssl = settings["ssl"]
-        port = settings["port"]
+        host = settings.host
+        database = settings.database
+        user = settings.user
+        passfile = settings.passfile
+        password = settings.password
+        ssl = settings.ssl
+        port = settings.port
 
     return await asyncpg.connect(host=host, port=port, user=user, password=password, passfile=passfile,
                                  database=database, ssl=ssl)
 
 
-async def update():
-    """Looks for new articles."""
-    # Load Settings
-    settings = await fetch_settings()
-    
-    table = settings["table"]
-    async with aiohttp.ClientSession() as session:
-        async with session.get("https://community.elitedangerous.com/") as response:
-            html = Bs4(await response.text(), "html.parser")
-
-    connection = await connect()
-
-    uids = []
-    new_articles = set()
+async def get_pool():
+    """Returns the shared connection pool, creating it from the settings file on first use."""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                settings = await get_settings()
+
+                # Statements are prepared once per connection, but the best plan for a search depends on its terms,
+                # so a plan is made for every call, instead of a generic plan after the first few.
+                _pool = await asyncpg.create_pool(host=settings.host, port=settings.port, user=settings.user,
+                                                  password=settings.password, passfile=settings.passfile,
+                                                  database=settings.database, ssl=settings.ssl,
+                                                  min_size=settings.pool_min_size, max_size=settings.pool_max_size,
+                                                  server_settings={"plan_cache_mode": "force_custom_plan"})
+    return _pool
+
+
+async def get_parser() -> extractor.Parser:
+    """Returns the shared HTML parser, creating it from the settings file on first use."""
+    global _parser
+    if _parser is None:
+        settings = await get_settings()
+        _parser = extractor.Parser(kind=settings.parser_executor, workers=settings.parser_workers)
+    return _parser
+
+
+async def get_search_cache() -> cache.LRUCache:
+    """Returns the cache of search and count results, creating it from the settings file on first use.
+    It is cleared whenever update() adds articles. Entries also expire, for changes made by other programs."""
+    global _search_cache
+    if _search_cache is None:
+        settings = await get_settings()
+        _search_cache = cache.LRUCache(max_size=settings.search_cache_size, ttl=settings.search_cache_ttl)
+    return _search_cache
+
+
+def get_index() -> typing.Optional[invertedindex.InvertedIndex]:
+    """Returns the in-memory search index, or None if it hasn't been built."""
+    return _index
+
+
+async def build_index() -> invertedindex.InvertedIndex:
+    """Builds an in-memory index of the articles table, which search and count use from then on,
+    instead of searching the database. (See invertedindex.py) Articles added by update() are added to it.
+    Only useful where this program is the only one adding articles."""
+    global _index
+    settings = await get_settings()
+
+    index = invertedindex.InvertedIndex()
+    pool = await get_pool()
+    async with _index_lock:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                async for row in connection.cursor(f"""
+                SELECT {_INDEX_COLUMNS} FROM "{settings.table}" ORDER BY "ID";
+                """):
+                    index.add(row["ID"], row["titleLexemes"], row["textLexemes"], row["dateReleased"])
+
+        _index = index
+    (await get_search_cache()).clear()
+    return index
+
+
+async def shutdown():
+    """Closes the shared connection pool and parser. Should be called once before the program exits."""
+    global _pool, _parser
+    if _pool is not None:
+        pool = _pool
+        _pool = None
+        await pool.close()
+    if _parser is not None:
+        parser = _parser
+        _parser = None
+        await asyncio.get_event_loop().run_in_executor(None, parser.shutdown)
+
+
+async def migrate(connection: asyncpg.Connection = None, table: str = None):
+    """Brings the columns and indexes of the articles table up to date. Safe to run more than once.
+    If no connection is given, one is borrowed from the pool, and the table from the settings file is used."""
+    if connection is None:
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            return await migrate(connection, table)
+
+    if table is None:
+        table = (await get_settings()).table
+
+    # Lookups by UID and date. Ingestion relies on UIDs being unique.
+    try:
+        await connection.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS "{table}_UID_key" ON "{table}" ("UID");
+        """)
+    except asyncpg.exceptions.UniqueViolationError as e:
+        raise RuntimeError(f"The table \"{table}\" has articles with duplicate UIDs."
+                           f" Run upgrade.py to remove them, then try again.") from e
+    # Searches are ordered by ("dateReleased", "ID"), and pages of results start after a row in that order
+    await connection.execute(f"""
+        CREATE INDEX IF NOT EXISTS "{table}_dateReleased_ID_idx" ON "{table}" ("dateReleased", "ID");
+        DROP INDEX IF EXISTS "{table}_dateReleased_idx";
+    """)
 
-    uid_records = await connection.fetch(f"""
-                SELECT "UID" FROM "{table}" ORDER BY "dateReleased" DESC LIMIT 50;
+    # Full text search (Requires Postgres 12 or newer)
+    await connection.execute(f"""
+        ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "searchVector" tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce("Title", '')), 'A') ||
+            setweight(to_tsvector('english', coalesce("Text", '')), 'B')
+        ) STORED;
+        CREATE INDEX IF NOT EXISTS "{table}_searchVector_idx" ON "{table}" USING GIN ("searchVector");
     """)
 
-    for record in uid_records:
-        uids.append(record["UID"])
+    # Substring search
+    try:
+        await connection.execute("""
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        """)
+    except (asyncpg.exceptions.InsufficientPrivilegeError, asyncpg.exceptions.FeatureNotSupportedError):
+        print("Could not enable the pg_trgm extension, substring searches will not be indexed.")
+    else:
+        await connection.execute(f"""
+            CREATE INDEX IF NOT EXISTS "{table}_Title_trgm_idx" ON "{table}" USING GIN (lower("Title") gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS "{table}_Text_trgm_idx" ON "{table}" USING GIN (lower("Text") gin_trgm_ops);
+        """)
 
-    for entry in html.find_all("h3", {"class": "hiLite galnetNewsArticleTitle"}):
-        entry = entry.find("a").get("href")[re.search("^/galnet/uid/", entry.find("a").get("href")).end():]
-        if entry not in uids:
-            new_articles.add(entry)
 
+async def insert_articles(connection: asyncpg.Connection, articles: list, table: str, batch_size: int = 500):
+    """Writes articles to a table, with one statement and transaction per batch of `batch_size` articles.
+    Each article is a tuple of (Title, UID, dateReleased, dateAdded, Text).
+    Articles with a UID that is already in the table are skipped. Returns the UIDs of the articles that were added.
+    If a batch fails, it is rolled back and the error is raised. Earlier batches are kept."""
     added = []
-    for article in new_articles:
-        date_today = datetime.datetime.now()
+    for start in range(0, len(articles), batch_size):
+        async with connection.transaction():
+            rows = await connection.fetch(f"""
+                INSERT INTO "{table}" ("Title", "UID", "dateReleased", "dateAdded", "Text")
+                SELECT * FROM unnest($1::text[], $2::text[], $3::date[], $4::date[], $5::text[])
+                ON CONFLICT ("UID") DO NOTHING
+                RETURNING "UID";
+            """, *(list(column) for column in zip(*articles[start:start + batch_size])))
+        added.extend(row["UID"] for row in rows)
+    return added
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"https://community.elitedangerous.com/galnet/uid/{article}") as response:
-                bs4 = Bs4(await response.text(), "html.parser")
-                entry = bs4.find("h3", {"class": "hiLite galnetNewsArticleTitle"})
 
-        # Article Content
-        entry_title = entry.get_text().strip().replace("'", "''")
-        if entry_title == "" or entry_title is None:
-            entry_title = "No Title Available"
-
-        text = unquote(bs4.find_all("p")[1].get_text().replace("'", "''"))
+async def update():
+    """Looks for new articles."""
+    # Load Settings
+    settings = await get_settings()
 
-        # Date info
-        date_article = bs4.find("p").get_text()
-        date_article = datetime.datetime.strptime(date_article, "%d %b %Y")
-        if date_article.year >= 3300:
-            date_article = date_article.replace(year=(date_article.year - GAME_YEAR_OFFSET))
+    table = settings.table
+    front_page = f"{settings.base_url}/"
+    added = []
 
-        added.append(article)
-        await connection.execute(f"""
-            INSERT INTO "{table}"("Title", "UID", "dateReleased", "dateAdded", "Text") VALUES (
-            $1, $2, $3, $4, $5);
-            """, entry_title, article, date_article, date_today, text)
+    async with crawler.Crawler() as pages:
+        async def fetch(url):
+            return await pages.fetch_if_changed(url, _page_cache)
+
+        async def parse(_, html):
+            if html is None:
+                # Nothing changed since the last update
+                return []
+
+            parser = await get_parser()
+            entries = await parser(extractor.parse_articles, html)
+
+            # Articles the front page didn't fully include are read from their own page
+            for index, entry in enumerate(entries):
+                if entry.text is None or entry.date_released is None:
+                    entries[index] = await parser(extractor.parse_article_page,
+                                                  await pages.fetch(f"{settings.base_url}/galnet/uid/{entry.uid}"))
+
+            # The front page lists the newest articles first
+            date_today = datetime.datetime.now()
+            return [(entry.title, entry.uid, entry.date_released, date_today, entry.text)
+                    for entry in reversed(entries)]
+
+        async def write(batch):
+            articles = [article for _, page_articles in batch for article in page_articles]
+            if articles:
+                pool = await get_pool()
+                # Articles are either inserted before the index is built, or added to it after
+                async with _index_lock:
+                    async with pool.acquire() as connection:
+                        uids = await insert_articles(connection, articles, table, settings.batch_size)
+                        if uids and _index is not None:
+                            for row in await connection.fetch(f"""
+                            SELECT {_INDEX_COLUMNS} FROM "{table}" WHERE "UID" = ANY($1);
+                            """, uids):
+                                _index.add(row["ID"], row["titleLexemes"], row["textLexemes"], row["dateReleased"])
+                added.extend(uids)
 
-    await connection.close()
-    if len(new_articles) > 0:
+        try:
+            await pipeline.Pipeline(fetch, parse, write, fetchers=1, parsers=1,
+                                    batch_size=settings.batch_size).run([front_page])
+        except BaseException:
+            # Make sure the page is processed again next time
+            _page_cache.forget(front_page)
+            raise
+
+    if len(added) > 0:
+        # Cached results don't include the new articles
+        (await get_search_cache()).clear()
         return len(added), added
 
 
-async def search(terms):
-    """Searches the DB for given input.
-    Options:
-    --title: Searches only in the titles of the articles (default search mode)
-    --content: Searches only in the content of an article, and ignores the title
-    --searchall: Searches both title and content of an article
-    --searchreverse: Searches the DB from the oldest article
-    --limit: Returns only the latest results up to number given (default 5). Format: limit=XYZ
-    --limitall: Returns all results found
-    --before: Looks for articles that were written before a given date. Format: YYYY-MM-DD
-    --after: Looks for articles that were written after a given date. Format: YYYY-MM-DD
-    If both the --after & --before tags are given, the search is limited to the dates between both options."""
+@dataclasses.dataclass
+class _Query:
+    """A search input, split into its search terms and options.
+    `expression` is the parsed search terms (See querylang.py), or None if there are none."""
+    words: list = dataclasses.field(default_factory=list)
+    expression: typing.Any = None
+    options: list = dataclasses.field(default_factory=list)
+    limit: int = 5
+    searchorder: str = "DESC"
+    datebegin: typing.Any = None
+    dateend: typing.Any = None
 
-    # Load Settings
-    settings = await fetch_settings()
-    table = settings["table"]
-
-    if ";" in terms:
-        terms.replace(";", "")
-        return "You can't use ';' in your searches!"
-    terms = terms.split(" ")
-    options = []
-    words = []
-    results = []
-    limit = 5
-    searchorder = "DESC"
-    datebegin = "0000-00-00"
-    dateend = "4000-01-01"
-
-    # Separating Options and Search Terms
-    for item in terms:
+
+def _parse_terms(terms: str) -> _Query:
+    """Separates the options from the search terms of a search input."""
+    query = _Query()
+
+    for item in terms.split(" "):
         if "--" in item[:2]:
             option = item.replace("--", "")
             if option == "limitall" or option == "listall":
-                limit = 10000000
+                query.limit = 10000000
             elif "limit" in option:
                 try:
-                    limit = int(option[6:])
+                    query.limit = max(0, int(option[6:]))
                 except ValueError:
-                    limit = 5
+                    query.limit = 5
             elif "before" in option:
                 year = datetime.datetime.strptime(option[7:], "%Y-%m-%d").year
                 # Convert date to format stored table
                 if year >= 3300:
                     converted_year = str(year - GAME_YEAR_OFFSET) + option[11:]
-                    dateend = datetime.datetime.strptime(converted_year, "%Y-%m-%d")
+                    query.dateend = datetime.datetime.strptime(converted_year, "%Y-%m-%d")
                 else:
-                    dateend = datetime.datetime.strptime(option[7:], "%Y-%m-%d")
-                options.append("before")
+                    query.dateend = datetime.datetime.strptime(option[7:], "%Y-%m-%d")
+                query.options.append("before")
             elif "after" in option:
                 year = datetime.datetime.strptime(option[6:], "%Y-%m-%d").year
                 # Convert date to format stored in table
                 if year >= 3300:
                     converted_year = str(year - GAME_YEAR_OFFSET) + option[10:]
-                    datebegin = datetime.datetime.strptime(converted_year, "%Y-%m-%d")
+                    query.datebegin = datetime.datetime.strptime(converted_year, "%Y-%m-%d")
                 else:
-                    datebegin = datetime.datetime.strptime(option[6:], "%Y-%m-%d")
-                options.append("after")
+                    query.datebegin = datetime.datetime.strptime(option[6:], "%Y-%m-%d")
+                query.options.append("after")
             elif option == "searchreverse":
-                searchorder = "ASC"
+                query.searchorder = "ASC"
             else:
-                options.append(option)
+                query.options.append(option)
+        elif item:
+            query.words.append(item)
+
+    query.expression = querylang.parse(" ".join(query.words))
+    return query
+
+
+def _cache_key(kind: str, table: str, query: _Query) -> tuple:
+    """Returns a key for a query, that is the same for every input with the same results."""
+    # Parsed expressions are normalized, so the order and repeats of terms don't matter
+    return (kind, table, query.expression, tuple(sorted(set(query.options))),
+            query.limit, query.searchorder, query.datebegin, query.dateend)
+
+
+async def _lexemes(words: typing.Iterable[str]) -> dict:
+    """Returns the lexemes of query words, as to_tsquery finds them, by word. Stop words have none.
+    Words are only looked up in the database the first time they are searched for."""
+    found = {}
+    missing = []
+    for word in words:
+        lexemes = _lexeme_cache.get(word)
+        if lexemes is None:
+            missing.append(word)
         else:
-            words.append(item.lower())
-
-    # Searching
-    connection = await connect()
-    if "before" in options and "after" in options:
-        rows = await connection.fetch(f"""
-        SELECT * FROM "{table}" 
-        WHERE "dateReleased" BETWEEN $1 AND $2
-        ORDER BY "dateReleased" {searchorder};
-        """, datebegin, dateend)
-    elif "before" in options:
-        rows = await connection.fetch(f"""
-                SELECT * FROM "{table}" 
-                WHERE "dateReleased" < $1
-                ORDER BY "dateReleased" {searchorder};
-                """, dateend)
-    elif "after" in options:
-        rows = await connection.fetch(f"""
-                    SELECT * FROM "{table}" 
-                    WHERE "dateReleased" > $1
-                    ORDER BY "dateReleased" {searchorder};
-                    """, datebegin)
-    else:
-        rows = await connection.fetch(f"""
-        SELECT * FROM "{table}" ORDER BY "dateReleased" {searchorder};
-        """)
-    await connection.close()
-    if "searchall" in options:
-        for row in rows:
-            for word in words:
-                if word in row["Title"].lower():
-                    results.append(row)
-                if word in row["Text"].lower():
-                    if row in results:
-                        pass
-                    else:
-                        results.append(row)
-    elif "content" in options:
+            found[word] = lexemes
+
+    if missing:
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            rows = await connection.fetch("""
+            SELECT word, ARRAY(SELECT lexeme FROM unnest(to_tsvector('english', word))) AS lexemes
+            FROM unnest($1::text[]) AS word;
+            """, missing)
         for row in rows:
-            for word in words:
-                if word in row["Text"].lower():
-                    results.append(row)
+            found[row["word"]] = tuple(row["lexemes"])
+            _lexeme_cache.put(row["word"], found[row["word"]])
+    return found
+
+
+async def _match_index(query: _Query) -> typing.Optional[set]:
+    """Returns the IDs of the articles that match a query, using the in-memory index.
+    Returns None if there is no index, or the query can't be answered by it."""
+    if _index is None or "substring" in query.options or "rank" in query.options:
+        # The index doesn't keep how often words appear, so it can't rank results
+        return None
+
+    words = set() if query.expression is None else invertedindex.words(query.expression)
+    if words is None:
+        return None
+
+    if "searchall" in query.options:
+        fields = ("title", "content")
+    elif "content" in query.options:
+        fields = ("content",)
     else:
-        for row in rows:
-            for word in words:
-                if word in row["Title"].lower():
-                    results.append(row)
-    return results[:limit], len(results)
+        fields = ("title",)
+
+    # The same bounds as the date conditions in _build_conditions
+    earliest, latest = None, None
+    if "before" in query.options and "after" in query.options:
+        earliest, latest = query.datebegin.date(), query.dateend.date()
+    elif "before" in query.options:
+        latest = query.dateend.date() - datetime.timedelta(days=1)
+    elif "after" in query.options:
+        earliest = query.datebegin.date() + datetime.timedelta(days=1)
+
+    return _index.match(query.expression, fields, earliest, latest, await _lexemes(words))
+
+
+def _tsquery(query: _Query) -> typing.Union[str, bool]:
+    """Returns the full text query for the search terms of a query.
+    Returns True or False instead if it matches every article or none. Title words are weighted A, and content words B.
+    """
+    def weights(field):
+        if field == "title":
+            return "A"
+        if field == "content":
+            return "B"
+        if "searchall" in query.options:
+            return "AB"
+        return "B" if "content" in query.options else "A"
+
+    return querylang.to_tsquery(query.expression, weights)
+
+
+def _build_conditions(query: _Query, args: list) -> list:
+    """Builds the WHERE conditions for a query, appending their parameters to args."""
+    conditions = []
+
+    if query.expression is not None and "substring" in query.options:
+        # Substring search, assisted by the trigram indexes
+        def columns(field):
+            if field == "title":
+                return ['lower("Title")']
+            if field == "content":
+                return ['lower("Text")']
+            if "searchall" in query.options:
+                return ['lower("Title")', 'lower("Text")']
+            return ['lower("Text")'] if "content" in query.options else ['lower("Title")']
+
+        conditions.append(querylang.to_like(query.expression, columns, args))
+
+    elif query.expression is not None:
+        # Full text search
+        tsquery = _tsquery(query)
+        if tsquery is False:
+            conditions.append("FALSE")
+        elif tsquery is not True:
+            args.append(tsquery)
+            conditions.append(f'"searchVector" @@ to_tsquery(\'english\', ${len(args)})')
+
+    if "before" in query.options and "after" in query.options:
+        args.extend([query.datebegin, query.dateend])
+        conditions.append(f'"dateReleased" BETWEEN ${len(args) - 1} AND ${len(args)}')
+    elif "before" in query.options:
+        args.append(query.dateend)
+        conditions.append(f'"dateReleased" < ${len(args)}')
+    elif "after" in query.options:
+        args.append(query.datebegin)
+        conditions.append(f'"dateReleased" > ${len(args)}')
+
+    return conditions
+
+
+def _result_columns(query: _Query) -> str:
+    """Returns the columns a search returns. The text of the articles is only included when it is searched."""
+    columns = ['"ID"', '"Title"', '"UID"', '"dateReleased"', '"dateAdded"']
+    if "content" in query.options or "searchall" in query.options:
+        columns.append('"Text"')
+    return ", ".join(columns)
+
+
+def _rank_column(query: _Query, args: list) -> typing.Optional[str]:
+    """Returns the relevance score of --rank searches, appending its parameter to args.
+    Returns None if the query isn't ranked. Title matches count for more than content matches."""
+    if "rank" not in query.options or "substring" in query.options or not isinstance(_tsquery(query), str):
+        return None
+    args.append(_tsquery(query))
+    return f'ts_rank(\'{{{RANK_WEIGHTS}}}\', "searchVector", to_tsquery(\'english\', ${len(args)}))'
 
 
-async def read(articleid=True, uid=False):
-    """Returns the article with the matching ID.
-    If the input is invalid or the article is not found, empty list is returned."""
+async def search(terms):
+    """Searches the DB for given input.
+    Options:
+    --title: Searches only in the titles of the articles (default search mode)
+    --content: Searches only in the content of an article, and ignores the title
+    --searchall: Searches both title and content of an article
+    --substring: Matches the terms anywhere inside words, instead of matching whole words
+    --searchreverse: Searches the DB from the oldest article
+    --rank: Returns the most relevant results first, instead of the newest. Matches in the title count the most.
+            Results that are as relevant are returned newest first, even with --searchreverse
+    --limit: Returns only the latest results up to number given (default 5). Format: limit=XYZ
+    --limitall: Returns all results found
+    --before: Looks for articles that were written before a given date. Format: YYYY-MM-DD
+    --after: Looks for articles that were written after a given date. Format: YYYY-MM-DD
+    If both the --after & --before tags are given, the search is limited to the dates between both options.
+    Results have the ID, Title, UID, dateReleased and dateAdded of the articles, and their Text for --content
+    and --searchall searches.
+    Terms can be combined with AND, OR, NOT, "phrases", (groups), and title: or content: prefixes. (See querylang.py)
+    """
 
     # Load Settings
-    settings = await fetch_settings()
-    table = settings["table"]
+    settings = await get_settings()
+    table = settings.table
+
+    query = _parse_terms(terms)
+    if query.expression is None:
+        return [], 0
+
+    # Searching
+    async def run():
+        if query.limit == 0:
+            return (), await _count(table, query)
+        pool = await get_pool()
+
+        columns = _result_columns(query)
+        matches = await _match_index(query)
+        if matches is not None:
+            # Only the results are read from the database
+            ids = _index.newest(matches, query.limit, oldest_first=query.searchorder == "ASC")
+            async with pool.acquire() as connection:
+                rows = await connection.fetch(f"""
+                SELECT {columns} FROM "{table}" WHERE "ID" = ANY($1);
+                """, ids)
+            order = {article_id: position for position, article_id in enumerate(ids)}
+            return tuple(sorted(rows, key=lambda row: order[row["ID"]])), len(matches)
+
+        args = []
+        conditions = _build_conditions(query, args)
+
+        rank = ""
+        order = f'"dateReleased" {query.searchorder}, "ID" {query.searchorder}'
+        score = _rank_column(query, args)
+        if score is not None:
+            # The database keeps only the best `limit` rows. Ties are newest first, like in search_page.
+            rank = f', {score} AS "rank"'
+            order = '"rank" DESC, "dateReleased" DESC, "ID" DESC'
+        args.append(query.limit)
+
+        # Rows are streamed from a server side cursor, and reading stops once there are enough
+        async def read_rows():
+            rows = []
+            async with pool.acquire() as connection:
+                async with connection.transaction():
+                    async for row in connection.cursor(f"""
+                    SELECT {columns}{rank}
+                    FROM "{table}"
+                    WHERE {" AND ".join(conditions) or "TRUE"}
+                    ORDER BY {order}
+                    LIMIT ${len(args)};
+                    """, *args, prefetch=min(query.limit, CURSOR_PREFETCH)):
+                        rows.append(row)
+                        if len(rows) >= query.limit:
+                            break
+            return rows
+
+        # Fewer rows than the limit are all the results, so the total is only counted when the limit is reached
+        rows = await read_rows()
+        total = await _count(table, query) if len(rows) >= query.limit else len(rows)
+        return tuple(rows), total
+
+    rows, total = await (await get_search_cache()).get_or_compute(_cache_key("search", table, query), run)
+    return list(rows), total
+
+
+class SearchPage(typing.NamedTuple):
+    """A page of search results. `start` is the position of the first row among all the results, and `total` is
+    the number of results, up to the --limit of the search. `matches` is the number of articles that match the
+    search, without the limit. `next` and `previous` are cursors for search_page, or None on the last and first pages.
+    """
+    rows: list
+    total: int
+    matches: int
+    start: int
+    next: typing.Optional[str]
+    previous: typing.Optional[str]
+
+
+def _encode_cursor(position: int, key: list, size: int = None) -> str:
+    """Returns a cursor for the page starting at `position`, which comes after the row with `key` in the order of
+    the results. If `size` is given, the page is instead the `size` rows before that row."""
+    return base64.urlsafe_b64encode(json.dumps({"p": position, "k": key, "s": size}).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    """Returns the position, key and size of a cursor. Raises ValueError if it isn't a valid cursor."""
+    try:
+        fields = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(fields["p"]), list(fields["k"]), fields["s"] and int(fields["s"])
+    except (KeyError, TypeError, UnicodeError, AttributeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
 
+async def search_page(terms: str, cursor: str = None, page_size: int = 8) -> SearchPage:
+    """Returns one page of the results of a search, in the same order as search(). (See search for the options)
+    The first page is returned without a cursor, and the others with the `next` and `previous` cursors of
+    the page before or after them.
+
+    Pages are found from the last row of the page before them, using the index on ("dateReleased", "ID"),
+    so every page costs the same to read, and articles added in between don't shift the pages."""
+    # Load Settings
+    settings = await get_settings()
+    table = settings.table
+
+    query = _parse_terms(terms)
+    if query.expression is None:
+        return SearchPage([], 0, 0, 0, None, None)
+    position, key, size = _decode_cursor(cursor) if cursor else (0, None, None)
+    backwards = size is not None
+
+    async def run():
+        matches = await _count(table, query)
+        total = min(matches, query.limit)
+        limit = size if backwards else max(0, min(page_size, total - position))
+
+        # Rows are compared by (rank, date released, ID), in the order of the results, or against it for
+        # the page before the cursor
+        args = []
+        conditions = _build_conditions(query, args)
+        score = _rank_column(query, args)
+        descending = score is not None or query.searchorder == "DESC"
+        if backwards:
+            descending = not descending
+        direction = "DESC" if descending else "ASC"
+        keys = ([score] if score is not None else []) + ['"dateReleased"', '"ID"']
+
+        rows = []
+        pool = await get_pool()
+        indexed = await _match_index(query)
+        if limit and indexed is not None:
+            # Only the rows of the page are read from the database
+            after = (key[-2], key[-1]) if key else None
+            ids = _index.newest(indexed, limit, oldest_first=not descending, after=after)
+            async with pool.acquire() as connection:
+                rows = await connection.fetch(f"""
+                SELECT "ID", "Title", "UID", "dateReleased", "dateAdded" FROM "{table}" WHERE "ID" = ANY($1);
+                """, ids)
+            order = {article_id: index for index, article_id in enumerate(ids)}
+            rows.sort(key=lambda row: order[row["ID"]])
+
+        elif limit:
+            if key:
+                placeholders = []
+                for value in key[:-2] + [datetime.date.fromordinal(key[-2]), key[-1]]:
+                    args.append(value)
+                    placeholders.append(f"${len(args)}")
+                conditions.append(f'({", ".join(keys)}) {"<" if descending else ">"} ({", ".join(placeholders)})')
+            args.append(limit)
+
+            rank = "" if score is None else f', {score} AS "rank"'
+            async with pool.acquire() as connection:
+                rows = await connection.fetch(f"""
+                SELECT "ID", "Title", "UID", "dateReleased", "dateAdded"{rank}
+                FROM "{table}"
+                WHERE {" AND ".join(conditions) or "TRUE"}
+                ORDER BY {", ".join(f"{column} {direction}" for column in keys)}
+                LIMIT ${len(args)};
+                """, *args)
+
+        if backwards:
+            rows.reverse()
+        start = max(0, position)
+
+        def row_key(row):
+            return ([row["rank"]] if score is not None else []) + [row["dateReleased"].toordinal(), row["ID"]]
+
+        following, preceding = None, None
+        if rows and start + len(rows) < total:
+            following = _encode_cursor(start + len(rows), row_key(rows[-1]))
+        if rows and start > 0:
+            preceding = _encode_cursor(max(0, start - page_size), row_key(rows[0]), start - max(0, start - page_size))
+        return SearchPage(tuple(rows), total, matches, start, following, preceding)
+
+    page = await (await get_search_cache()).get_or_compute(
+        _cache_key("page", table, query) + (cursor, page_size), run)
+    return page._replace(rows=list(page.rows))
+
+
+async def read(articleid=True, uid=False):
+    """Returns the article with the matching ID.
+    If the input is invalid or the article is not found, empty list is returned."""
     if uid:
-        connection = await connect()
-        row = await connection.fetch(f"""
-        SELECT * FROM "{table}" WHERE "UID" = $1;
-        """, str(uid))
-        await connection.close()
-        return row
+        return await read_many(uids=[uid])
     try:
         articleid = int(articleid)
     except ValueError:
         return []
-    connection = await connect()
-    rows = await connection.fetch(f"""
-    SELECT * FROM "{table}" WHERE "ID" = $1;
-    """, articleid)
-    await connection.close()
+    return await read_many(ids=[articleid])
+
 
-    result = []
-    for row in rows:
-        row_dict = dict(row)
-        row_dict["dateReleased"] = row["dateReleased"].replace(year=(row["dateReleased"].year + GAME_YEAR_OFFSET))
+async def read_many(ids: typing.Iterable[int] = None, uids: typing.Iterable[str] = None) -> list:
+    """Returns the articles with the given IDs and UIDs, with a single query.
+    Articles are returned as dictionaries, in the order they were asked for. Articles that aren't found are left out.
+    Release dates are converted to in-game dates."""
+    ids = [int(articleid) for articleid in ids or []]
+    uids = [str(uid) for uid in uids or []]
+    if not ids and not uids:
+        return []
 
-        result.append(row_dict)
+    # Load Settings
+    settings = await get_settings()
+    table = settings.table
 
-    return result
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        rows = await connection.fetch(f"""
+        SELECT {_READ_COLUMNS} FROM "{table}" WHERE "ID" = ANY($1) OR "UID" = ANY($2);
+        """, ids, uids)
+
+    by_id = {row["ID"]: row for row in rows}
+    by_uid = {row["UID"]: row for row in rows}
+    return [_article(row) for row in [by_id.get(articleid) for articleid in ids] + [by_uid.get(uid) for uid in uids]
+            if row is not None]
+
+
+async def latest(amount: int = 20) -> list:
+    """Returns the newest articles, newest first, like read_many."""
+    # Load Settings
+    settings = await get_settings()
+    table = settings.table
+
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        rows = await connection.fetch(f"""
+        SELECT {_READ_COLUMNS} FROM "{table}" ORDER BY "dateReleased" DESC, "ID" DESC LIMIT $1;
+        """, amount)
+    return [_article(row) for row in rows]
+
+
+def _article(row: asyncpg.Record) -> dict:
+    """Returns an article read from the table as a dictionary, with an in-game release date."""
+    row_dict = dict(row)
+    row_dict["dateReleased"] = game_date(row["dateReleased"])
+    return row_dict
+
+
+def game_date(date: datetime.date) -> datetime.date:
+    """Converts a date stored in the table to an in-game date."""
+    try:
+        return date.replace(year=(date.year + GAME_YEAR_OFFSET))
+    except ValueError:
+        # 29 February, in a year that isn't a leap year in game
+        return date.replace(year=(date.year + GAME_YEAR_OFFSET), day=28)
 
 
 async def count(options):
@@ -284,17 +809,43 @@ async def count(options):
     --all: Counts the amount of articles that contain a certain term in either the title or the content.
     --before: Counts the amount of articles before a given date. Format: YYYY-MM-DD
     --after: Counts the amount of articles after a given date. Format: YYYY-MM-DD
-    If both the --after & --before tags are given, the search is limited to the dates between both options."""
-    if ";" in options:
-        options.replace(";", "")
-        return "You can't use ';'!"
-    options = options.replace("--all", "--searchall")
-    results = await search(f"--limitall {options}")
-    return results[1]
+    --substring: Matches the terms anywhere inside words, instead of matching whole words.
+    If no terms are given, all articles between the given dates are counted.
+    If both the --after & --before tags are given, the search is limited to the dates between both options.
+    Terms can be combined like in search."""
+    # Load Settings
+    settings = await get_settings()
+    table = settings.table
+
+    return await _count(table, _parse_terms(options.replace("--all", "--searchall")))
 
 
-async def clean_up():
-    """Remove articles with duplicate UUIDs from database, and update all IDs."""
+async def _count(table: str, query: _Query) -> int:
+    """Counts the articles that match a query."""
+    async def run():
+        matches = await _match_index(query)
+        if matches is not None:
+            return len(matches)
+
+        args = []
+        conditions = _build_conditions(query, args)
+
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            return await connection.fetchval(f"""
+            SELECT COUNT(*) FROM "{table}"
+            WHERE {" AND ".join(conditions) or "TRUE"};
+            """, *args)
+
+    # The limit and order don't change the count
+    query = dataclasses.replace(query, limit=None, searchorder=None)
+    return await (await get_search_cache()).get_or_compute(_cache_key("count", table, query), run)
+
+
+async def clean_up(batch_size: int = 5000, progress: typing.Callable[[str, int, int], None] = None):
+    """Remove articles with duplicate UUIDs from database, and update all IDs.
+    Rows are changed in transactions of at most `batch_size` rows, so the table is never locked for long.
+    After every batch, `progress` is called with the name of the current step, the rows done, and the total rows."""
     # Load Settings
     settings = await fetch_settings()
 
@@ -307,73 +858,101 @@ async def clean_up():
     old_version = settings["previous version"]
     new_version = settings["version"]
 
-    if float(new_version) <= 1.2:
-        # Deleting repeats
-        connection = await connect()
-        repeats = await connection.fetch(f"""
-            SELECT * FROM "{settings["table"]}"
-            WHERE "UID" IN (SELECT "UID" FROM "{settings["table"]}" GROUP BY "UID" HAVING COUNT(*) > 1);
-        """)
-
-        uniques = {}
-        removed = []
+    def report(step, done, total):
+        if progress is not None:
+            progress(step, done, total)
 
-        for article in repeats:
-            if article["UID"] in uniques.keys():
-                removed.append(uniques[article["UID"]]["ID"])
-            uniques[article["UID"]] = article
+    if float(new_version) <= 1.2:
+        table = settings["table"]
 
-        for article_id in removed:
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            # Deleting repeats, keeping the newest copy of each article
             await connection.execute(f"""
-                DELETE FROM "{settings["table"]}"
-                WHERE "ID" = {article_id};
+                DROP TABLE IF EXISTS clean_up_repeats;
+                CREATE TEMPORARY TABLE clean_up_repeats AS
+                SELECT "ID" FROM (
+                    SELECT "ID", row_number() OVER (PARTITION BY "UID" ORDER BY "ID" DESC) AS copy
+                    FROM "{table}" WHERE "UID" IS NOT NULL
+                ) AS copies
+                WHERE copy > 1;
+            """)
+            total = await connection.fetchval("""
+                SELECT COUNT(*) FROM clean_up_repeats;
             """)
 
-        # Fixing IDs
-        all_articles = await connection.fetch(f"""
-            SELECT * FROM "{settings["table"]}";
-        """)
-
-        transaction = connection.transaction()
-        await transaction.start()
+            done = 0
+            report("Removing duplicates", done, total)
+            while done < total:
+                async with connection.transaction():
+                    done += await connection.fetchval(f"""
+                        WITH batch AS (
+                            DELETE FROM clean_up_repeats
+                            WHERE "ID" IN (SELECT "ID" FROM clean_up_repeats LIMIT $1)
+                            RETURNING "ID"
+                        ), deleted AS (
+                            DELETE FROM "{table}" WHERE "ID" IN (SELECT "ID" FROM batch) RETURNING 1
+                        )
+                        SELECT COUNT(*) FROM batch;
+                    """, batch_size)
+                report("Removing duplicates", done, total)
+
+            # Fixing titles and dates
+            await connection.execute(f"""
+                UPDATE "{table}" SET "Title" = 'No Title Available'
+                WHERE "Title" IS NULL OR btrim("Title", E' \\t\\r\\n') = '';
+                UPDATE "{table}" SET "Title" = btrim("Title", E' \\t\\r\\n')
+                WHERE "Title" <> btrim("Title", E' \\t\\r\\n');
+                UPDATE "{table}" SET "dateReleased" = ("dateReleased" - interval '{GAME_YEAR_OFFSET} years')::date
+                WHERE "dateReleased" >= '3300-01-01';
+            """)
 
-        try:
-            # Empty Table
+            # Fixing IDs
+            # A run that stopped part way leaves moved articles with their new ID negated. (See below)
             await connection.execute(f"""
-                DELETE FROM "{settings["table"]}";
+                UPDATE "{table}" SET "ID" = -"ID" WHERE "ID" < 0;
+                DROP TABLE IF EXISTS clean_up_ids;
+                CREATE TEMPORARY TABLE clean_up_ids AS
+                SELECT * FROM (
+                    SELECT "ID" AS old_id, row_number() OVER (ORDER BY "ID") AS new_id FROM "{table}"
+                ) AS ids
+                WHERE old_id <> new_id;
+                CREATE INDEX ON clean_up_ids (new_id);
             """)
+            first, last = await connection.fetchrow("""
+                SELECT COALESCE(MIN(new_id), 1), COALESCE(MAX(new_id), 0) FROM clean_up_ids;
+            """)
+            total = last - first + 1
+
+            # IDs must stay unique after every statement, so articles are first moved to their negated new ID,
+            # where they can't collide with any other article, and only then to their new ID.
+            for step, statement in (
+                    ("Renumbering articles (1/2)", f"""
+                        UPDATE "{table}" SET "ID" = -ids.new_id FROM clean_up_ids AS ids
+                        WHERE "{table}"."ID" = ids.old_id AND ids.new_id BETWEEN $1 AND $2;
+                    """),
+                    ("Renumbering articles (2/2)", f"""
+                        UPDATE "{table}" SET "ID" = -"ID" WHERE "ID" BETWEEN -$2::integer AND -$1::integer;
+                    """)):
+                report(step, 0, total)
+                for start in range(first, last + 1, batch_size):
+                    end = min(start + batch_size - 1, last)
+                    async with connection.transaction():
+                        await connection.execute(statement, start, end)
+                    report(step, end - first + 1, total)
 
             # Reset ID Column
             await connection.execute(f"""
-                ALTER SEQUENCE "{settings["table"]}_ID_seq"
-                RESTART WITH 1
+                SELECT setval(pg_get_serial_sequence('"{table}"', 'ID'), COALESCE(MAX("ID"), 0) + 1, false)
+                FROM "{table}";
+                DROP TABLE clean_up_repeats;
+                DROP TABLE clean_up_ids;
             """)
 
-            # Reinsert Articles
-            for article in all_articles:
-                text = unquote(article["Text"].replace("'", "''"))
-
-                date_released = article["dateReleased"]
-                if date_released.year >= 3300:
-                    date_released = date_released.replace(year=(article["dateReleased"].year - GAME_YEAR_OFFSET))
-
-                title = article["Title"].strip().replace("'", "''")
-                if title == "" or title is None:
-                    title = "No Title Available"
-
-                await connection.execute(f"""
-                    INSERT INTO "{settings["table"]}" ("Title", "UID", "dateReleased", "dateAdded", "Text")
-                    VALUES ($1, $2, $3, $4, $5);
-                """, title, article["UID"], date_released, article["dateAdded"], text)
-        except Exception as e:
-            print("\n\nProcess failed due to exception. Reverting.\n\n")
-            await transaction.rollback()
-            raise e
-
-        else:
-            await transaction.commit()
-
-        await connection.close()
+        # Cached results and the index may have old IDs
+        (await get_search_cache()).clear()
+        if _index is not None:
+            await build_index()
 
     settings = await fetch_settings()
     settings["previous version"] = settings["version"]
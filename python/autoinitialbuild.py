@@ -5,6 +5,7 @@ import asyncio
 
 from python import initialbuild
 
+# If the build stops part way, running this again resumes it, and retries the dates that failed.
 loop = asyncio.get_event_loop()
 loop.run_until_complete(initialbuild.db_builder(host="localhost", database="postgres"))
 loop.close()
@@ -0,0 +1,99 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+import asyncio
+import collections
+import time
+import typing
+
+# Marks a missing entry, since None can be cached
+_MISSING = object()
+
+
+class LRUCache:
+    """A least recently used cache of at most `max_size` entries, which expire `ttl` seconds after they are added.
+    A ttl of None keeps entries until they are evicted. Hits and misses are counted in `hits` and `misses`.
+
+    Usage:
+    cache = LRUCache(max_size=256, ttl=300)
+    value = await cache.get_or_compute(key, compute)
+    """
+
+    def __init__(self, max_size: int = 256, ttl: typing.Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._pending = {}
+        # Bumped by clear(), so values computed before it are not stored
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the cached value for a key, or default if there is none. Counts a hit or a miss."""
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return _MISSING
+        if self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    async def get_or_compute(self, key, compute: typing.Callable[[], typing.Awaitable]):
+        """Returns the cached value for a key, or awaits compute() for it and caches the result.
+        Concurrent calls for the same missing key share a single compute() call."""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        if key in self._pending:
+            # Another call is already computing it
+            self.hits += 1
+            return await asyncio.shield(self._pending[key])
+        self.misses += 1
+
+        generation = self._generation
+        future = asyncio.ensure_future(compute())
+        self._pending[key] = future
+        try:
+            value = await asyncio.shield(future)
+        finally:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+        if generation == self._generation:
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """Removes every entry. Values that are being computed while this is called are not cached."""
+        self._entries.clear()
+        self._pending.clear()
+        self._generation += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
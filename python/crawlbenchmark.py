@@ -0,0 +1,136 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+"""Benchmarks a full build and incremental updates against a local Galnet stand-in. (See fakegalnet.py)
+
+Requires a Postgres database. The articles are written to a separate table (BenchmarkArticles by default),
+which is dropped before and after the run. Settings files are written to a temporary directory,
+so the ones in the current directory are left alone.
+
+Example: python -m python.crawlbenchmark --articles 5000 --latency 0.05 --updates 5
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import tempfile
+import time
+
+import asyncpg
+
+from python import articlesearch, fakegalnet, initialbuild
+
+
+def report(name: str, seconds: float, pages: int, articles: int):
+    print(f"{name}: {seconds:.2f}s, {pages} pages ({pages / seconds:.1f} pages/s),"
+          f" {articles} articles ({articles / seconds:.1f} articles/s)")
+
+
+async def drop_tables(options):
+    connection = await asyncpg.connect(host=options.host, port=options.port, user=options.user,
+                                       password=options.password, database=options.database)
+    await connection.execute(f"""
+        DROP TABLE IF EXISTS "{options.table}";
+        DROP TABLE IF EXISTS "{options.table}_crawl";
+    """)
+    await connection.close()
+
+
+async def count_articles(options) -> int:
+    connection = await asyncpg.connect(host=options.host, port=options.port, user=options.user,
+                                       password=options.password, database=options.database)
+    total = await connection.fetchval(f"""
+        SELECT COUNT(*) FROM "{options.table}";
+    """)
+    await connection.close()
+    return total
+
+
+async def benchmark(options):
+    galnet = fakegalnet.FakeGalnet(articles=options.articles, articles_per_date=options.per_date,
+                                   latency=options.latency, jitter=options.jitter, error_rate=options.error_rate,
+                                   bodies_on_listing=not options.titles_only)
+    base_url = await galnet.start()
+    await drop_tables(options)
+
+    try:
+        # Full build
+        start = time.perf_counter()
+        await initialbuild.db_builder(host=options.host, database=options.database, table=options.table,
+                                      user=options.user, password=options.password, port=options.port,
+                                      concurrency=options.concurrency, delay=options.delay,
+                                      batch_size=options.batch_size, parser_executor=options.parser,
+                                      base_url=base_url, save_settings=False)
+        seconds = time.perf_counter() - start
+        stored = await count_articles(options)
+        report("Full build", seconds, galnet.requests, stored)
+        if stored != len(galnet.articles):
+            print(f"Warning: {stored} articles were stored, out of {len(galnet.articles)}")
+
+        # Incremental updates
+        with open("Settings.json", "w") as settings_file:
+            json.dump(dataclasses.asdict(articlesearch.Settings(
+                host=options.host, database=options.database, table=options.table, user=options.user,
+                password=options.password, port=options.port, batch_size=options.batch_size,
+                parser_executor=options.parser, base_url=base_url)), settings_file, indent=2)
+
+        for number in range(1, options.updates + 1):
+            galnet.publish(options.new_articles)
+            requests = galnet.requests
+
+            start = time.perf_counter()
+            result = await articlesearch.update()
+            seconds = time.perf_counter() - start
+            report(f"Update {number}", seconds, galnet.requests - requests, result[0] if result else 0)
+
+        # An update with nothing new
+        requests = galnet.requests
+        start = time.perf_counter()
+        await articlesearch.update()
+        report("Unchanged update", time.perf_counter() - start, galnet.requests - requests, 0)
+
+        if galnet.errors:
+            print(f"{galnet.errors} requests were answered with errors")
+
+    finally:
+        await articlesearch.shutdown()
+        await galnet.stop()
+        if not options.keep:
+            await drop_tables(options)
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Benchmarks the crawler against a local Galnet stand-in.")
+    arguments.add_argument("--host", default="localhost")
+    arguments.add_argument("--port", type=int, default=None)
+    arguments.add_argument("--database", default="postgres")
+    arguments.add_argument("--user", default="postgres")
+    arguments.add_argument("--password", default=None)
+    arguments.add_argument("--table", default="BenchmarkArticles")
+    arguments.add_argument("--keep", action="store_true", help="Keep the benchmark table afterwards")
+
+    arguments.add_argument("--articles", type=int, default=2000, help="Number of articles in the corpus")
+    arguments.add_argument("--per-date", type=int, default=3, help="Average number of articles per date")
+    arguments.add_argument("--latency", type=float, default=0.02, help="Seconds to wait before every response")
+    arguments.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    arguments.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with 503")
+    arguments.add_argument("--titles-only", action="store_true", help="Leave article bodies out of listing pages")
+
+    arguments.add_argument("--concurrency", type=int, default=8)
+    arguments.add_argument("--delay", type=float, default=0.0, help="Politeness delay between requests")
+    arguments.add_argument("--batch-size", type=int, default=500)
+    arguments.add_argument("--parser", choices=("process", "thread"), default="process")
+    arguments.add_argument("--updates", type=int, default=3, help="Number of incremental updates to run")
+    arguments.add_argument("--new-articles", type=int, default=5, help="New articles published before each update")
+    options = arguments.parse_args()
+
+    # db_builder and update read and write Settings.json in the working directory
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            asyncio.get_event_loop().run_until_complete(benchmark(options))
+        finally:
+            os.chdir(working_directory)
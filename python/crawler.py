@@ -0,0 +1,130 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+import asyncio
+import hashlib
+import random
+import typing
+from urllib.parse import urlsplit
+
+import aiohttp
+
+BASE_URL = "https://community.elitedangerous.com"
+
+
+class Crawler:
+    """Fetches pages through one shared session.
+    At most `concurrency` requests run at once, requests to the same host are spaced out by `delay` seconds,
+    and failed requests (connection errors, timeouts, 429 and 5xx responses) are retried `retries` times
+    with an exponential backoff.
+
+    Usage:
+    async with Crawler() as crawler:
+        html = await crawler.fetch(url)
+    """
+
+    def __init__(self, concurrency: int = 8, delay: float = 0.1, retries: int = 3, backoff: float = 1.0,
+                 timeout: float = 30):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = None
+        self._semaphore = None
+        self._next_request = {}
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.session.close()
+
+    async def _wait_turn(self, host: str):
+        """Waits until the politeness delay for a host has passed, and reserves the next slot."""
+        now = asyncio.get_event_loop().time()
+        slot = max(now, self._next_request.get(host, now))
+        self._next_request[host] = slot + self.delay
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _get(self, url: str, headers: dict = None) -> typing.Tuple[int, typing.Mapping, str]:
+        """Returns the status, headers and text of a response. Raises the last error if all attempts fail."""
+        host = urlsplit(url).netloc
+
+        for attempt in range(self.retries + 1):
+            async with self._semaphore:
+                await self._wait_turn(host)
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        if response.status < 400:
+                            return response.status, response.headers, await response.text()
+
+                        error = aiohttp.ClientResponseError(response.request_info, response.history,
+                                                            status=response.status, message=response.reason)
+                        if response.status < 500 and response.status != 429:
+                            # Retrying won't fix client errors
+                            raise error
+
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                    error = e
+
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+
+        raise error
+
+    async def fetch(self, url: str) -> str:
+        """Returns the text of a page. Raises the last error if all attempts fail."""
+        return (await self._get(url))[2]
+
+    async def fetch_if_changed(self, url: str, cache: "PageCache") -> typing.Optional[str]:
+        """Returns the text of a page, or None if it hasn't changed since it was last fetched with the same cache.
+        A conditional request is sent using the validators stored in the cache, and a page sent in full
+        is still treated as unchanged if its body is identical."""
+        entry = cache.get(url)
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        status, response_headers, text = await self._get(url, headers)
+        if status == 304:
+            return None
+
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        cache.store(url, CacheEntry(response_headers.get("ETag"), response_headers.get("Last-Modified"), digest))
+        if entry is not None and entry.digest == digest:
+            return None
+        return text
+
+
+class CacheEntry(typing.NamedTuple):
+    """The validators and body hash of a fetched page."""
+    etag: typing.Optional[str]
+    last_modified: typing.Optional[str]
+    digest: str
+
+
+class PageCache:
+    """Stores the validators of fetched pages, for use with Crawler.fetch_if_changed."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, url: str) -> typing.Optional[CacheEntry]:
+        return self._entries.get(url)
+
+    def store(self, url: str, entry: CacheEntry):
+        self._entries[url] = entry
+
+    def forget(self, url: str):
+        """Removes a page, so the next fetch downloads and returns it in full.
+        Should be called if the page returned by fetch_if_changed couldn't be processed."""
+        self._entries.pop(url, None)
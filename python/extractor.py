@@ -0,0 +1,149 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import multiprocessing
+import re
+import typing
+from urllib.parse import unquote
+
+from bs4 import BeautifulSoup as Bs4, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+GAME_YEAR_OFFSET = 1286
+
+# Only the parts of a page that are read are built into a tree
+ARTICLE_TITLE = {"class": "hiLite galnetNewsArticleTitle"}
+ARTICLES_ONLY = SoupStrainer("div", {"class": "article"})
+DATE_FILTER_ONLY = SoupStrainer(id="block-frontier-galnet-frontier-galnet-block-filter")
+
+
+class Parser:
+    """Runs the parsing functions of this module in an executor, so they don't block the event loop.
+    `kind` is either "process" (the default), which lets parsing use every core, or "thread".
+    Process pools are only used where processes can be forked, since spawned workers would re-run the
+    main script (Like the discord bot). Elsewhere, a thread pool is used instead.
+
+    Usage:
+    parser = Parser()
+    articles = await parser(parse_articles, html)
+    parser.shutdown()
+    """
+
+    def __init__(self, kind: str = "process", workers: int = None):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown executor kind: {kind}. Must be \"process\" or \"thread\".")
+
+        if kind == "process" and "fork" in multiprocessing.get_all_start_methods():
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    async def __call__(self, function: typing.Callable, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(self.executor,
+                                                              functools.partial(function, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class Article(typing.NamedTuple):
+    """An article parsed from a Galnet page. `text` and `date_released` are None if the page didn't include them."""
+    title: str
+    uid: str
+    date_released: typing.Optional[datetime.date]
+    text: typing.Optional[str]
+
+
+def convert_date(date: datetime.datetime) -> datetime.date:
+    """Converts an in-game date to the date stored in the table."""
+    if date.year >= 3300:
+        date = date.replace(year=(date.year - GAME_YEAR_OFFSET))
+    return date.date()
+
+
+def parse_date_links(html: str) -> list:
+    """Returns the links to every date page from the filter block, oldest first."""
+    bs4 = Bs4(html, HTML_PARSER, parse_only=DATE_FILTER_ONLY)
+
+    links = []
+    for link in bs4.find_all("a"):
+        links.append(link.get("href"))
+    links.reverse()
+    return links
+
+
+def parse_link_date(link: str) -> datetime.date:
+    """Returns the date of a date page from its link. Format: /galnet/DD-MMM-YYYY"""
+    return convert_date(datetime.datetime.strptime(link.replace("#", "")[re.search("^/galnet/", link).end():],
+                                                   "%d-%b-%Y"))
+
+
+def _parse_title(entry) -> typing.Tuple[str, str]:
+    """Returns the title and UID from an article heading."""
+    entry_title = entry.get_text().strip().replace("'", "''")
+    if entry_title == "" or entry_title is None:
+        entry_title = "No Title Available"
+
+    href = entry.find("a").get("href")
+    return entry_title, href[re.search("^/galnet/uid/", href).end():]
+
+
+def _parse_paragraphs(paragraphs: list) -> typing.Tuple[typing.Optional[datetime.date], typing.Optional[str]]:
+    """Returns the date and text of an article from its paragraphs."""
+    date_article = None
+    text = None
+
+    if paragraphs:
+        try:
+            date_article = convert_date(datetime.datetime.strptime(paragraphs[0].get_text().strip(), "%d %b %Y"))
+        except ValueError:
+            pass
+    if len(paragraphs) > 1:
+        text = unquote(paragraphs[1].get_text().replace("'", "''"))
+
+    return date_article, text
+
+
+def parse_articles(html: str, date_released: datetime.date = None) -> list:
+    """Returns every article on a listing page (the front page, or a date page), in page order.
+    Articles that aren't wrapped in their own container have no text, and must be read from their own page.
+    `date_released` is used for articles without a readable date."""
+    entries = Bs4(html, HTML_PARSER, parse_only=ARTICLES_ONLY).find_all("h3", ARTICLE_TITLE)
+    if not entries:
+        # The articles aren't in their usual containers
+        entries = Bs4(html, HTML_PARSER).find_all("h3", ARTICLE_TITLE)
+
+    articles = []
+    for entry in entries:
+        entry_title, entry_uid = _parse_title(entry)
+
+        date_article, text = None, None
+        container = entry.find_parent("div", {"class": "article"})
+        if container is not None:
+            date_article, text = _parse_paragraphs(container.find_all("p"))
+
+        articles.append(Article(entry_title, entry_uid, date_article or date_released, text))
+
+    return articles
+
+
+def parse_article_page(html: str) -> Article:
+    """Returns the article from its own page (/galnet/uid/{uid})."""
+    bs4 = Bs4(html, HTML_PARSER, parse_only=ARTICLES_ONLY)
+    if bs4.find("h3", ARTICLE_TITLE) is None:
+        # The article isn't in its usual container
+        bs4 = Bs4(html, HTML_PARSER)
+
+    entry_title, entry_uid = _parse_title(bs4.find("h3", ARTICLE_TITLE))
+    date_article, text = _parse_paragraphs(bs4.find_all("p"))
+    return Article(entry_title, entry_uid, date_article, text)
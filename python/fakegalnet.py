@@ -0,0 +1,223 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+"""A local stand-in for the Galnet website, for testing and benchmarking the crawler without using the real site.
+
+Serves a synthetic corpus in the same layout as community.elitedangerous.com:
+- /                      The front page: the date filter block, and the newest articles.
+- /galnet/DD-MMM-YYYY    A date page, with every article from that date.
+- /galnet/uid/{uid}/     An article page.
+Recorded pages can be served instead, by saving them in a directory. (See FakeGalnet)
+
+Run it on its own with: python -m python.fakegalnet --port 8080
+"""
+
+import argparse
+import asyncio
+import calendar
+import datetime
+import hashlib
+import os
+import random
+import socket
+import typing
+import uuid
+
+from aiohttp import web
+
+from python import extractor
+
+WORDS = ("thargoid", "azimuth", "federation", "empire", "alliance", "aegis", "guardian", "salvation", "system",
+         "pilots", "federal", "imperial", "senator", "president", "fleet", "carrier", "station", "conflict",
+         "community", "goal", "engineers", "independent", "faction", "galactic", "cooperative", "research",
+         "spokesperson", "announced", "reports", "attack", "the", "of", "and", "in", "to", "a", "has", "was")
+
+
+class FakeArticle(typing.NamedTuple):
+    uid: str
+    title: str
+    date: datetime.date
+    text: str
+
+
+def iter_synthetic_articles(count: int, articles_per_date: int = 3,
+                            start: datetime.date = datetime.date(3301, 1, 5), seed: int = 0,
+                            paragraphs: typing.Tuple[int, int] = (2, 8)) -> typing.Iterator[FakeArticle]:
+    """Yields `count` Galnet-style articles with in-game dates, oldest first.
+    Each article has between paragraphs[0] and paragraphs[1] paragraphs of text."""
+    generator = random.Random(seed)
+
+    made = 0
+    date = start
+    while made < count:
+        if date.month == 2 and date.day == 29 and not calendar.isleap(date.year - extractor.GAME_YEAR_OFFSET):
+            # In-game dates follow the real calendar, which has no such day
+            date += datetime.timedelta(days=1)
+            continue
+        for _ in range(min(generator.randint(1, 2 * articles_per_date - 1), count - made)):
+            title = " ".join(generator.choice(WORDS) for _ in range(generator.randint(3, 8))).title()
+            text = "\n".join(" ".join(generator.choice(WORDS) for _ in range(generator.randint(40, 120))) + "."
+                             for _ in range(generator.randint(*paragraphs)))
+            yield FakeArticle(uuid.UUID(int=generator.getrandbits(128)).hex[:24], title, date, text)
+            made += 1
+        date += datetime.timedelta(days=1)
+
+
+def synthetic_articles(count: int, articles_per_date: int = 3, start: datetime.date = datetime.date(3301, 1, 5),
+                       seed: int = 0) -> list:
+    """Returns `count` Galnet-style articles with in-game dates, oldest first."""
+    return list(iter_synthetic_articles(count, articles_per_date, start, seed))
+
+
+def _link(date: datetime.date) -> str:
+    return f"/galnet/{date.day:02d}-{date.strftime('%b').upper()}-{date.year}"
+
+
+class FakeGalnet:
+    """Serves a synthetic Galnet corpus of `articles` articles, about `articles_per_date` per date.
+
+    latency: Seconds to wait before every response, plus up to `jitter` random seconds.
+    error_rate: Fraction of requests answered with a 503 error.
+    bodies_on_listing: If False, listing pages only include titles, so every article page must be fetched.
+    front_page_size: Number of articles on the front page.
+    recorded: A directory of recorded pages. A request for /a/b/ is answered with `a_b.html` from it, if it exists.
+    The front page is recorded as `index.html`.
+    """
+
+    def __init__(self, articles: int = 1000, articles_per_date: int = 3, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, bodies_on_listing: bool = True, front_page_size: int = 20,
+                 recorded: str = None, seed: int = 0):
+        self.articles = synthetic_articles(articles, articles_per_date, seed=seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bodies_on_listing = bodies_on_listing
+        self.front_page_size = front_page_size
+        self.recorded = recorded
+
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._runner = None
+        self._index()
+
+    def _index(self):
+        self._by_uid = {article.uid: article for article in self.articles}
+        self._by_date = {}
+        for article in self.articles:
+            self._by_date.setdefault(_link(article.date), []).append(article)
+
+    def publish(self, count: int) -> list:
+        """Adds `count` new articles, dated after the newest one, and returns them."""
+        start = (self.articles[-1].date + datetime.timedelta(days=1)) if self.articles else datetime.date(3301, 1, 5)
+        new = synthetic_articles(count, count, start=start, seed=self._random.getrandbits(32))
+        self.articles.extend(new)
+        self._index()
+        return new
+
+    @staticmethod
+    def _render_article(article: FakeArticle, body: bool = True) -> str:
+        html = (f'<div class="article"><h3 class="hiLite galnetNewsArticleTitle">'
+                f'<a href="/galnet/uid/{article.uid}">{article.title}</a></h3>')
+        if body:
+            html += (f'<div><p class="small hiLite">{article.date.strftime("%d %b %Y").upper()}</p></div>'
+                     f'<p>{article.text.replace(chr(10), "<br>")}</p>')
+        return html + "</div>"
+
+    def _render_page(self, articles: list, body: bool = True) -> str:
+        dates = "".join(f'<a href="{link}">{link[8:]}</a>' for link in reversed(list(self._by_date)))
+        return ("<html><head><title>Galnet</title></head><body>"
+                f'<div id="block-frontier-galnet-frontier-galnet-block-filter">{dates}</div>'
+                f'<div class="content">{"".join(self._render_article(article, body) for article in articles)}</div>'
+                "</body></html>")
+
+    def _recorded(self, path: str) -> typing.Optional[str]:
+        if self.recorded is None:
+            return None
+        name = path.strip("/").replace("/", "_") or "index"
+        file = os.path.join(self.recorded, f"{name}.html")
+        if os.path.exists(file):
+            with open(file, encoding="utf-8") as recording:
+                return recording.read()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text="Service Unavailable")
+
+        path = request.path
+        date_link = "/galnet/" + path.rstrip("/")[len("/galnet/"):].upper()
+        uid = path[len("/galnet/uid/"):].strip("/")
+
+        html = self._recorded(path)
+        if html is None:
+            if path == "/":
+                html = self._render_page(list(reversed(self.articles[-self.front_page_size:])),
+                                         self.bodies_on_listing)
+            elif path.startswith("/galnet/uid/") and uid in self._by_uid:
+                html = self._render_page([self._by_uid[uid]])
+            elif path.startswith("/galnet/") and date_link in self._by_date:
+                html = self._render_page(self._by_date[date_link], self.bodies_on_listing)
+            else:
+                return web.Response(status=404, text="Not Found")
+
+        etag = f'"{hashlib.sha256(html.encode()).hexdigest()[:16]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=html, content_type="text/html", headers={"ETag": etag})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts the server, and returns its base URL. Port 0 picks a free port."""
+        app = web.Application()
+        app.router.add_get("/{path:.*}", self._handle)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        await web.SockSite(self._runner, sock).start()
+        return f"http://{host}:{sock.getsockname()[1]}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def expected_articles(self) -> list:
+        """Returns the corpus as the crawler should store it: (Title, UID, dateReleased, Text)."""
+        expected = []
+        for article in self.articles:
+            date_released = extractor.convert_date(datetime.datetime.combine(article.date, datetime.time()))
+            expected.append((article.title, article.uid, date_released, article.text.replace("\n", "")))
+        return expected
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Serves a local stand-in for the Galnet website.")
+    arguments.add_argument("--host", default="127.0.0.1")
+    arguments.add_argument("--port", type=int, default=8080)
+    arguments.add_argument("--articles", type=int, default=1000, help="Number of articles in the corpus")
+    arguments.add_argument("--per-date", type=int, default=3, help="Average number of articles per date")
+    arguments.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before every response")
+    arguments.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    arguments.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with 503")
+    arguments.add_argument("--titles-only", action="store_true", help="Leave article bodies out of listing pages")
+    arguments.add_argument("--recorded", help="Directory of recorded pages to serve")
+    options = arguments.parse_args()
+
+    galnet = FakeGalnet(articles=options.articles, articles_per_date=options.per_date, latency=options.latency,
+                        jitter=options.jitter, error_rate=options.error_rate,
+                        bodies_on_listing=not options.titles_only, recorded=options.recorded)
+
+    loop = asyncio.get_event_loop()
+    url = loop.run_until_complete(galnet.start(options.host, options.port))
+    print(f"Serving {len(galnet.articles)} articles on {url}")
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(galnet.stop())
@@ -1,84 +1,153 @@
 #  Copyright (c) 2020 Hassan Abouelela
 #  Licensed under the MIT License
 
+import asyncio
 import datetime
 import json
 import os
-import re
-from urllib.parse import unquote
 
-import aiohttp
 import asyncpg
-from bs4 import BeautifulSoup as Bs4
 
-from python import articlesearch
+from python import articlesearch, crawler, extractor, pipeline
 
 
 async def db_builder(host: str, database: str, table: str = "Articles", create_table=True, user: str = "postgres",
-                     passfile=None, password: str = None, ssl=False, port: int = None):
-    """Builds an article database, with all articles to date."""
-    # Establishing DB Connection
-    connection = await asyncpg.connect(host=host, port=port, user=user, password=password,
-                                       passfile=passfile, database=database, ssl=ssl)
-
-    # Make table if one is not provided
-    if create_table:
-        table = table.strip()
+                     passfile=None, password: str = None, ssl=False, port: int = None, concurrency: int = 8,
+                     delay: float = 0.1, retries: int = 3, batch_size: int = 500, parser_executor: str = "process",
+                     parser_workers: int = None, max_attempts: int = 5, queue_size: int = 16,
+                     base_url: str = crawler.BASE_URL, save_settings: bool = True):
+    """Builds an article database, with all articles to date.
+    Pages go through a pipeline of fetching, parsing and writing, with at most `queue_size` pages waiting
+    between stages. Up to `concurrency` pages are downloaded at once, with `delay` seconds between requests,
+    and failed requests are retried `retries` times. Pages are parsed by `parser_workers` workers of a
+    `parser_executor` pool ("process" or "thread"). Articles are still inserted in order of date,
+    `batch_size` articles at a time.
+
+    The progress of every date page is kept in the "{table}_crawl" table. If a build is stopped, running it again
+    resumes it, skipping the dates that were already added. Dates that failed are retried on every run,
+    until they have failed `max_attempts` times.
+    Pages are downloaded from `base_url`, which can point to a local stand-in for testing. (See fakegalnet.py)
+    Unless `save_settings` is False, Settings.json is replaced with one for the new database."""
+    # Establishing DB Connections
+    pool = await asyncpg.create_pool(host=host, port=port, user=user, password=password,
+                                     passfile=passfile, database=database, ssl=ssl, min_size=2, max_size=2)
+
+    async with pool.acquire() as connection:
+        # Make table if one is not provided
+        if create_table:
+            table = table.strip()
+            await connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS "{table}" (
+            "ID" serial NOT NULL, 
+            "Title" text, 
+            "UID" text, 
+            "dateReleased" date, 
+            "dateAdded" date, 
+            "Text" text,
+            PRIMARY KEY ("ID"));
+            ALTER TABLE "{table}" OWNER to "{user}";
+            """)
+
+        # Building indexes and search columns (Ingestion relies on the unique UID index)
+        await articlesearch.migrate(connection, table)
+
+        # Crawl state. Status is one of: pending, fetched, ingested
         await connection.execute(f"""
-        CREATE TABLE "{table}" (
-        "ID" serial NOT NULL, 
-        "Title" text, 
-        "UID" text, 
-        "dateReleased" date, 
-        "dateAdded" date, 
-        "Text" text,
-        PRIMARY KEY ("ID"));
-        ALTER TABLE "{table}" OWNER to "{user}";
+        CREATE TABLE IF NOT EXISTS "{table}_crawl" (
+        "Link" text NOT NULL,
+        "Position" integer NOT NULL,
+        "Status" text NOT NULL DEFAULT 'pending',
+        "Attempts" integer NOT NULL DEFAULT 0,
+        "lastError" text,
+        "lastAttempt" timestamp,
+        PRIMARY KEY ("Link"));
         """)
 
     # Collecting Links and articles
-    links = []
-    date_now = datetime.datetime.now().strftime("%Y-%m-%d")
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get("https://community.elitedangerous.com/#") as response:
-            bs4 = Bs4(await response.text(), "html.parser")
-
-    for entry in bs4.find_all(id="block-frontier-galnet-frontier-galnet-block-filter"):
-        for link in entry.find_all("a"):
-            links.append(link.get("href"))
-    links.reverse()
-
-    for result in links:
-        date_article = datetime.datetime.strptime(result.replace("#", "")[re.search("^/galnet/", result).end():],
-                                                  "%d-%b-%Y")
-        if date_article.year >= 3300:
-            date_article = date_article.replace(year=(date_article.year - articlesearch.GAME_YEAR_OFFSET))
-        date_article = date_article.strftime("%Y-%m-%d")
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"https://community.elitedangerous.com{result}") as response:
-                bs4 = Bs4(await response.text(), "html.parser")
-
-        for entry in bs4.find_all("h3", {"class": "hiLite galnetNewsArticleTitle"}):
-            entry_title = entry.get_text().strip().replace("'", "''")
-            if entry_title == "" or entry_title is None:
-                entry_title = "No Title Available"
-
-            entry_uid = entry.find("a").get("href")[re.search("^/galnet/uid/", entry.find("a").get("href")).end():]
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"https://community.elitedangerous.com/galnet/uid/{entry_uid}/") as response:
-                    bs4 = Bs4(await response.text(), "html.parser")
-            text = unquote(bs4.find_all("p")[1].get_text().replace("'", "''"))
-
-            await connection.execute(f"""
-            INSERT INTO "{table}"("Title", "UID", "dateReleased", "dateAdded", "Text")
-            VALUES($1, $2, $3, $4, $5);""", entry_title, entry_uid, date_article, date_now, text)
-
-    await connection.close()
+    date_now = datetime.date.today()
+
+    parser = extractor.Parser(kind=parser_executor, workers=parser_workers)
+    try:
+        async with crawler.Crawler(concurrency=concurrency, delay=delay, retries=retries) as pages:
+            links = await parser(extractor.parse_date_links, await pages.fetch(f"{base_url}/#"))
+
+            async with pool.acquire() as connection:
+                await connection.executemany(f"""
+                INSERT INTO "{table}_crawl" ("Link", "Position") VALUES ($1, $2)
+                ON CONFLICT ("Link") DO UPDATE SET "Position" = EXCLUDED."Position";
+                """, [(link, position) for position, link in enumerate(links)])
+
+                # Only failures count as attempts, so dates that were fetched before a build stopped are resumed
+                records = await connection.fetch(f"""
+                SELECT "Link", "Status" = 'fetched' OR "Attempts" < $1 AS "Retry" FROM "{table}_crawl"
+                WHERE "Status" <> 'ingested'
+                ORDER BY "Position";
+                """, max_attempts)
+                remaining = [record["Link"] for record in records if record["Retry"]]
+
+            skipped = len(records) - len(remaining)
+            if skipped:
+                print(f"Skipping {skipped} date pages that failed {max_attempts} times. "
+                      f"(See \"lastError\" in \"{table}_crawl\")")
+
+            async def record_attempt(result, error=None):
+                async with pool.acquire() as connection:
+                    await connection.execute(f"""
+                    UPDATE "{table}_crawl"
+                    SET "Status" = $2, "Attempts" = "Attempts" + $3, "lastError" = $4, "lastAttempt" = $5
+                    WHERE "Link" = $1;
+                    """, result, "pending" if error else "fetched", 1 if error else 0, error,
+                    datetime.datetime.now())
+
+            async def fetch_date(result):
+                return await pages.fetch(f"{base_url}{result}")
+
+            async def parse_date(result, html):
+                date_article = extractor.parse_link_date(result)
+                entries = await parser(extractor.parse_articles, html, date_article)
+
+                # Articles the date page didn't fully include are read from their own page
+                async def complete(entry):
+                    if entry.text is not None:
+                        return entry
+                    article = await parser(extractor.parse_article_page,
+                                           await pages.fetch(f"{base_url}/galnet/uid/{entry.uid}/"))
+                    return entry._replace(text=article.text)
+
+                entries = await asyncio.gather(*(complete(entry) for entry in entries))
+                await record_attempt(result)
+                return [(entry.title, entry.uid, date_article, date_now, entry.text) for entry in entries]
+
+            async def record_failure(result, error):
+                await record_attempt(result, f"{type(error).__name__}: {error}")
+
+            async def ingest(batch):
+                # The articles and the dates they came from are marked together
+                async with pool.acquire() as connection:
+                    async with connection.transaction():
+                        await articlesearch.insert_articles(connection, [article for _, articles in batch
+                                                                         for article in articles],
+                                                            table, batch_size)
+                        await connection.execute(f"""
+                        UPDATE "{table}_crawl" SET "Status" = 'ingested' WHERE "Link" = ANY($1);
+                        """, [result for result, _ in batch])
+
+            # Dates are downloaded and parsed concurrently, but inserted in order
+            stats = await pipeline.Pipeline(fetch_date, parse_date, ingest, record_failure,
+                                            fetchers=concurrency, parsers=parser_workers, queue_size=queue_size,
+                                            batch_size=batch_size).run(remaining)
+    finally:
+        parser.shutdown()
+        await pool.close()
+
+    print(f"Build finished: {stats}")
+    if stats.failed:
+        print(f"{stats.failed} date pages could not be added. Run the build again to retry them.")
 
     # Dumping Settings For Future Use
+    if not save_settings:
+        return
+
     if os.path.exists("Settings.json"):
         os.remove("Settings.json")
 
@@ -93,6 +162,7 @@ async def db_builder(host: str, database: str, table: str = "Articles", create_t
     settings["password"] = password
     settings["ssl"] = ssl
     settings["port"] = port
+    settings["base_url"] = base_url
 
     with open("Settings.json", "w+") as settings_file:
         json.dump(settings, settings_file, indent=2)
@@ -0,0 +1,187 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+import array
+import bisect
+import datetime
+import heapq
+import re
+import typing
+
+from python import querylang
+
+FIELDS = ("title", "text")
+# The fields of search queries, and the indexed fields they search
+FIELD_NAMES = {"title": "title", "content": "text"}
+
+_WORD = re.compile(r"\w+")
+
+
+class _Unsupported(Exception):
+    """Raised for queries the index can't answer."""
+
+
+def words(expression) -> typing.Optional[set]:
+    """Returns the words of a parsed query that need lexemes for match, or None if the index can't match it."""
+    if isinstance(expression, querylang.Term):
+        return set(_WORD.findall(expression.word.lower()))
+    if isinstance(expression, querylang.Not):
+        return words(expression.child)
+    if isinstance(expression, (querylang.And, querylang.Or)):
+        found = set()
+        for child in expression.children:
+            child_words = words(child)
+            if child_words is None:
+                return None
+            found |= child_words
+        return found
+    # Phrases need the positions of words, which aren't kept
+    return None
+
+
+def _insert(ids: array.array, article_id: int):
+    """Adds an ID to a sorted array, keeping it sorted."""
+    if not ids or ids[-1] < article_id:
+        ids.append(article_id)
+    else:
+        position = bisect.bisect_left(ids, article_id)
+        if position == len(ids) or ids[position] != article_id:
+            ids.insert(position, article_id)
+
+
+class InvertedIndex:
+    """An in-memory index from lexemes to the IDs of the articles that contain them, kept separately for titles
+    and texts. Postings are sorted arrays of 32-bit IDs, so the whole archive fits in a few megabytes.
+    Release dates are kept as day numbers, in an array parallel to the sorted article IDs.
+
+    Articles are added with the lexemes of their search vector, and the words of queries are matched by the prefix of
+    their lexemes, so results are the same as the full text search of the database.
+    """
+
+    def __init__(self):
+        self._ids = array.array("I")
+        self._dates = array.array("I")
+        self._postings = {field: {} for field in FIELDS}
+        # Sorted words of each field, for prefix lookups
+        self._words = {field: [] for field in FIELDS}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, article_id: int, title: typing.Iterable[str], text: typing.Iterable[str],
+            date_released: typing.Optional[datetime.date]):
+        """Adds an article to the index, with the lexemes of its title and text.
+        Adding an article that is already in it does nothing."""
+        position = bisect.bisect_left(self._ids, article_id)
+        if position < len(self._ids) and self._ids[position] == article_id:
+            return
+        self._ids.insert(position, article_id)
+        self._dates.insert(position, date_released.toordinal() if date_released else 0)
+
+        for field, content in zip(FIELDS, (title, text)):
+            postings = self._postings[field]
+            for word in set(content):
+                ids = postings.get(word)
+                if ids is None:
+                    ids = postings[word] = array.array("I")
+                    bisect.insort(self._words[field], word)
+                _insert(ids, article_id)
+
+    def _prefixed(self, field: str, prefix: str) -> set:
+        """Returns the IDs of the articles with a word starting with prefix in a field."""
+        words = self._words[field]
+        postings = self._postings[field]
+
+        ids = set()
+        position = bisect.bisect_left(words, prefix)
+        while position < len(words) and words[position].startswith(prefix):
+            ids.update(postings[words[position]])
+            position += 1
+        return ids
+
+    def _evaluate(self, node, fields: typing.Tuple[str, ...], lexemes: typing.Mapping[str, tuple]) \
+            -> typing.Optional[set]:
+        """Returns the IDs of the articles that match a node, or None if it only has stop words.
+        Like to_tsquery, terms with only stop words are left out of the query."""
+        if isinstance(node, querylang.Term):
+            fields = (FIELD_NAMES[node.field],) if node.field else fields
+            parts = _WORD.findall(node.word.lower())
+            if not parts:
+                # None of it can match a whole word (See querylang.to_tsquery)
+                return set()
+
+            found = None
+            # Words made of several parts (Like jump-drive) must match all of them
+            for part in parts:
+                if part not in lexemes or len(lexemes[part]) > 1:
+                    # The database matches words with several lexemes as phrases
+                    raise _Unsupported
+                if not lexemes[part]:
+                    # A stop word
+                    continue
+                ids = set().union(*(self._prefixed(field, lexemes[part][0]) for field in fields))
+                found = ids if found is None else found & ids
+            return found
+        if isinstance(node, querylang.Not):
+            child = self._evaluate(node.child, fields, lexemes)
+            return None if child is None else set(self._ids) - child
+
+        if not isinstance(node, (querylang.And, querylang.Or)):
+            raise _Unsupported
+        if not node.children:
+            return set(self._ids) if isinstance(node, querylang.And) else set()
+        children = [self._evaluate(child, fields, lexemes) for child in node.children]
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        if isinstance(node, querylang.And):
+            return set.intersection(*children)
+        return set().union(*children)
+
+    def match(self, expression, fields: typing.Iterable[str] = ("title",), earliest: datetime.date = None,
+              latest: datetime.date = None, lexemes: typing.Mapping[str, tuple] = None) -> typing.Optional[set]:
+        """Returns the IDs of the articles released between earliest and latest (inclusive) that match a parsed
+        query (See querylang.py), searching `fields` for terms without a field. If expression is None, every article
+        between the dates is returned.
+        `lexemes` has the lexemes of every word of the query (See words), as the database's english configuration
+        finds them. Returns None if the index can't match the query, like for phrases or words without lexemes."""
+        if expression is not None:
+            try:
+                matches = self._evaluate(expression, tuple(FIELD_NAMES[field] for field in fields), lexemes or {})
+            except _Unsupported:
+                return None
+            if matches is None:
+                # A query of only stop words matches nothing
+                matches = set()
+        else:
+            matches = None
+
+        if earliest is None and latest is None:
+            return set(self._ids) if matches is None else matches
+
+        earliest = earliest.toordinal() if earliest else 0
+        latest = latest.toordinal() if latest else datetime.date.max.toordinal()
+        if matches is None:
+            return {article_id for article_id, date in zip(self._ids, self._dates) if earliest <= date <= latest}
+        return {article_id for article_id in matches if earliest <= self.date_of(article_id) <= latest}
+
+    def date_of(self, article_id: int) -> int:
+        """Returns the day number of the release date of an article in the index."""
+        return self._dates[bisect.bisect_left(self._ids, article_id)]
+
+    def newest(self, ids: typing.Iterable[int], limit: int, oldest_first: bool = False,
+               after: typing.Tuple[int, int] = None) -> list:
+        """Returns up to `limit` of the IDs, ordered by release date and then ID, newest first.
+        If `after` is given as (day number, ID), only the IDs that come after it in that order are returned."""
+        def key(article_id):
+            return self.date_of(article_id), article_id
+
+        if after is not None:
+            after = tuple(after)
+            if oldest_first:
+                ids = [article_id for article_id in ids if key(article_id) > after]
+            else:
+                ids = [article_id for article_id in ids if key(article_id) < after]
+
+        select = heapq.nsmallest if oldest_first else heapq.nlargest
+        return select(limit, ids, key=key)
@@ -0,0 +1,179 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+import asyncio
+import dataclasses
+import os
+import typing
+
+# Marks the end of a queue
+_DONE = object()
+
+
+@dataclasses.dataclass
+class Stats:
+    """Counters for a pipeline run. The queue depths are the largest seen during the run."""
+    fetched: int = 0
+    parsed: int = 0
+    failed: int = 0
+    written: int = 0
+    articles: int = 0
+    batches: int = 0
+    max_fetch_queue: int = 0
+    max_parse_queue: int = 0
+    max_write_queue: int = 0
+
+    def __str__(self):
+        return (f"{self.fetched} fetched, {self.parsed} parsed, {self.failed} failed,"
+                f" {self.written} written ({self.articles} articles in {self.batches} batches)."
+                f" Largest queues: fetch {self.max_fetch_queue}, parse {self.max_parse_queue},"
+                f" write {self.max_write_queue}")
+
+
+class Pipeline:
+    """Runs items through three stages, connected by bounded queues:
+    - fetch(item) downloads an item, with `fetchers` running at once.
+    - parse(item, fetched) turns it into a list of articles, with `parsers` running at once.
+    - write(batch) stores a list of (item, articles) pairs. It is called by a single writer,
+      once at least `batch_size` articles are ready, and once more at the end.
+
+    Items are written in the order they were given. At most `in_flight` items are between the start of
+    the fetch stage and the writer, so memory use doesn't depend on the number of items.
+    If fetching or parsing an item raises an exception, on_error(item, error) is awaited in its place.
+    Without on_error, the exception stops the pipeline and is raised from run(). Errors from write always are.
+    """
+
+    def __init__(self, fetch: typing.Callable[[typing.Any], typing.Awaitable],
+                 parse: typing.Callable[[typing.Any, typing.Any], typing.Awaitable[list]],
+                 write: typing.Callable[[list], typing.Awaitable],
+                 on_error: typing.Callable[[typing.Any, Exception], typing.Awaitable] = None,
+                 fetchers: int = 8, parsers: int = None, queue_size: int = 16, batch_size: int = 500,
+                 in_flight: int = None):
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.on_error = on_error
+
+        self.fetchers = fetchers
+        self.parsers = parsers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.in_flight = in_flight or (self.fetchers + self.parsers + 2 * queue_size)
+
+        self.stats = Stats()
+
+    async def run(self, items: typing.Iterable) -> Stats:
+        """Runs every item through the pipeline, and returns the stats of the run."""
+        self.stats = Stats()
+        tokens = asyncio.Semaphore(self.in_flight)
+        fetch_queue = asyncio.Queue(self.queue_size)
+        parse_queue = asyncio.Queue(self.queue_size)
+        write_queue = asyncio.Queue(self.queue_size)
+
+        async def source():
+            for position, item in enumerate(items):
+                await tokens.acquire()
+                await fetch_queue.put((position, item))
+                self.stats.max_fetch_queue = max(self.stats.max_fetch_queue, fetch_queue.qsize())
+            for _ in range(self.fetchers):
+                await fetch_queue.put(_DONE)
+
+        async def fetcher():
+            while True:
+                job = await fetch_queue.get()
+                if job is _DONE:
+                    return
+                position, item = job
+                try:
+                    result = (position, item, await self.fetch(item), None)
+                    self.stats.fetched += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    result = (position, item, None, e)
+                await parse_queue.put(result)
+                self.stats.max_parse_queue = max(self.stats.max_parse_queue, parse_queue.qsize())
+
+        async def parser():
+            while True:
+                job = await parse_queue.get()
+                if job is _DONE:
+                    return
+                position, item, fetched, error = job
+                if error is None:
+                    try:
+                        job = (position, item, await self.parse(item, fetched), None)
+                        self.stats.parsed += 1
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        job = (position, item, None, e)
+                await write_queue.put(job)
+
+        async def writer():
+            # Results can finish out of order, so they wait here until every earlier item is done
+            waiting = {}
+            next_position = 0
+            batch = []
+            articles = 0
+
+            while True:
+                job = await write_queue.get()
+                if job is _DONE:
+                    break
+                waiting[job[0]] = job
+                self.stats.max_write_queue = max(self.stats.max_write_queue, len(waiting))
+
+                while next_position in waiting:
+                    _, item, parsed, error = waiting.pop(next_position)
+                    next_position += 1
+                    tokens.release()
+
+                    if error is not None:
+                        self.stats.failed += 1
+                        if self.on_error is None:
+                            raise error
+                        await self.on_error(item, error)
+                        continue
+
+                    batch.append((item, parsed))
+                    articles += len(parsed or [])
+                    if articles >= self.batch_size:
+                        await self._write(batch, articles)
+                        batch, articles = [], 0
+
+            if batch:
+                await self._write(batch, articles)
+
+        async def stages():
+            fetch_workers = [asyncio.ensure_future(fetcher()) for _ in range(self.fetchers)]
+            parse_workers = [asyncio.ensure_future(parser()) for _ in range(self.parsers)]
+            try:
+                await source()
+                await asyncio.gather(*fetch_workers)
+                for _ in range(self.parsers):
+                    await parse_queue.put(_DONE)
+                await asyncio.gather(*parse_workers)
+                await write_queue.put(_DONE)
+            finally:
+                for worker in fetch_workers + parse_workers:
+                    worker.cancel()
+
+        tasks = [asyncio.ensure_future(stages()), asyncio.ensure_future(writer())]
+        try:
+            # Stops as soon as either side fails
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return self.stats
+
+    async def _write(self, batch: list, articles: int):
+        await self.write(batch)
+        self.stats.written += len(batch)
+        self.stats.articles += articles
+        self.stats.batches += 1
@@ -0,0 +1,250 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+"""The search query language.
+
+Words are matched if any of them is found (OR). Other than that:
+- AND between two terms only matches articles with both. AND binds more tightly than OR.
+- NOT (or a leading -) before a term excludes the articles that match it.
+  (Like "thargoid -azimuth": Articles with thargoid, but without azimuth)
+  Joined to another term by an explicit OR, it adds the articles that don't match it instead.
+  (Like "thargoid OR NOT azimuth": Articles with thargoid, and articles without azimuth)
+- "Quoted words" only match as an exact phrase.
+- title: or content: before a term, phrase or (group) only searches that part of the articles.
+- (Parentheses) group terms.
+Operators must be in capitals, so "and", "or" and "not" are still searched for as words.
+
+Queries are parsed into a tree of the classes below, which is normalized, then compiled to a full text query
+(to_tsquery) or to LIKE conditions.
+"""
+
+import dataclasses
+import re
+import typing
+
+_TOKEN = re.compile(r'\s*(?:(?P<field>title|content):)?(?:"(?P<phrase>[^"]*)"?|(?P<open>\()|(?P<close>\))'
+                    r'|(?P<word>[^\s()"]+))', re.IGNORECASE)
+_LEXEME = re.compile(r"\w+")
+
+
+# Dataclasses rather than named tuples, so an And is never equal to an Or of the same children
+@dataclasses.dataclass(frozen=True)
+class Term:
+    word: str
+    field: typing.Optional[str] = None
+
+
+@dataclasses.dataclass(frozen=True)
+class Phrase:
+    words: typing.Tuple[str, ...]
+    field: typing.Optional[str] = None
+
+
+@dataclasses.dataclass(frozen=True)
+class And:
+    """Matches if all of its children match. With no children, it matches everything."""
+    children: tuple
+
+
+@dataclasses.dataclass(frozen=True)
+class Or:
+    """Matches if any of its children match. With no children, it matches nothing."""
+    children: tuple
+
+
+@dataclasses.dataclass(frozen=True)
+class Not:
+    child: typing.Any
+
+
+def _tokenize(text: str) -> list:
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            break
+        position = match.end()
+
+        field = match.group("field").lower() if match.group("field") else None
+        if match.group("phrase") is not None:
+            tokens.append(("phrase", match.group("phrase"), field))
+        elif match.group("open"):
+            tokens.append(("(", None, field))
+        elif match.group("close"):
+            tokens.append((")", None, None))
+        elif field is None and match.group("word") in ("AND", "OR", "NOT"):
+            tokens.append((match.group("word"), None, None))
+        elif field is None and match.group("word").startswith("-") and len(match.group("word")) > 1:
+            tokens.append(("NOT", None, None))
+            tokens.append(("word", match.group("word")[1:], None))
+        else:
+            tokens.append(("word", match.group("word"), field))
+    return tokens
+
+
+class _Parser:
+    """expression := conjunction ([OR] conjunction)*
+    conjunction := negation (AND negation)*
+    negation := NOT negation | primary
+    primary := [field:] (word | "phrase" | "(" expression ")")
+
+    Negated conjunctions of an expression are required of all of it, unless they are joined to another conjunction
+    by an explicit OR. (See the module docstring)
+    Mistakes are ignored where possible: unmatched parentheses, and operators without a term."""
+
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> typing.Optional[str]:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def expression(self, field: str = None, depth: int = 0):
+        children = []
+        # Whether each child is joined to the one before it by an explicit OR
+        joined = []
+        explicit = False
+        while self.peek() is not None:
+            if self.peek() == ")":
+                if depth:
+                    break
+                # A closing parenthesis that was never opened
+                self.position += 1
+            elif self.peek() in ("OR", "AND"):
+                explicit = explicit or (self.peek() == "OR" and bool(children))
+                self.position += 1
+            else:
+                child = self.conjunction(field, depth)
+                if child is not None:
+                    children.append(child)
+                    joined.append(explicit)
+                    explicit = False
+        # Negated terms exclude articles from the whole group, instead of adding every article without them,
+        # unless they are joined to another term by an explicit OR
+        joined.append(False)
+        excluded = [child for index, child in enumerate(children)
+                    if isinstance(child, Not) and not joined[index] and not joined[index + 1]]
+        children = [child for child in children if not any(child is other for other in excluded)]
+        if len(children) > 1:
+            children = [Or(tuple(children))]
+        children += excluded
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def conjunction(self, field: str, depth: int):
+        children = [self.negation(field, depth)]
+        while self.peek() == "AND":
+            self.position += 1
+            children.append(self.negation(field, depth))
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def negation(self, field: str, depth: int):
+        if self.peek() == "NOT":
+            self.position += 1
+            child = self.negation(field, depth)
+            return None if child is None else Not(child)
+        return self.primary(field, depth)
+
+    def primary(self, field: str, depth: int):
+        if self.peek() not in ("word", "phrase", "("):
+            return None
+        kind, value, token_field = self.tokens[self.position]
+        self.position += 1
+        field = token_field or field
+
+        if kind == "word":
+            return Term(value, field)
+        if kind == "phrase":
+            return Phrase(tuple(value.split()), field) if value.split() else None
+
+        group = self.expression(field, depth + 1)
+        if self.peek() == ")":
+            self.position += 1
+        return group
+
+
+def normalize(node):
+    """Lowercases the words of a query tree, flattens nested groups, and sorts and removes repeated terms,
+    so queries with the same results have the same tree."""
+    if isinstance(node, Term):
+        return Term(node.word.lower(), node.field)
+    if isinstance(node, Phrase):
+        return Phrase(tuple(word.lower() for word in node.words), node.field)
+    if isinstance(node, Not):
+        child = normalize(node.child)
+        return child.child if isinstance(child, Not) else Not(child)
+
+    children = set()
+    for child in (normalize(child) for child in node.children):
+        if type(child) is type(node):
+            children.update(child.children)
+        else:
+            children.add(child)
+    if len(children) == 1:
+        return children.pop()
+    return type(node)(tuple(sorted(children, key=repr)))
+
+
+def parse(text: str):
+    """Parses a query into a normalized tree, or returns None if it has no terms."""
+    tree = _Parser(_tokenize(text)).expression()
+    return None if tree is None else normalize(tree)
+
+
+def to_tsquery(node, weights: typing.Callable[[typing.Optional[str]], str]) -> typing.Union[str, bool]:
+    """Compiles a tree to a full text query, for to_tsquery.
+    weights(field) returns the weight labels of a field. ("A" for titles, "B" for content)
+    Returns True or False instead if the query matches everything or nothing."""
+    if isinstance(node, (Term, Phrase)):
+        # Only word characters are kept, so input can't change the structure of the query
+        words = [node.word] if isinstance(node, Term) else node.words
+        lexemes = [lexeme for word in words for lexeme in _LEXEME.findall(word)]
+        if not lexemes:
+            # None of it can match a whole word
+            return False
+        if isinstance(node, Term):
+            # Words match as prefixes. Words made of several parts (Like jump-drive) must match all of them.
+            query = " & ".join(f"{lexeme}:*{weights(node.field)}" for lexeme in lexemes)
+        else:
+            query = " <-> ".join(f"{lexeme}:{weights(node.field)}" for lexeme in lexemes)
+        return f"({query})" if len(lexemes) > 1 else query
+
+    if isinstance(node, Not):
+        child = to_tsquery(node.child, weights)
+        return (not child) if isinstance(child, bool) else f"!{child}"
+
+    # And, Or
+    identity = isinstance(node, And)
+    children = []
+    for child in (to_tsquery(child, weights) for child in node.children):
+        if child is (not identity):
+            return not identity
+        if child is not identity:
+            children.append(child)
+    if not children:
+        return identity
+    if len(children) == 1:
+        return children[0]
+    return "(" + (" & " if identity else " | ").join(children) + ")"
+
+
+def to_like(node, columns: typing.Callable[[typing.Optional[str]], list], args: list) -> str:
+    """Compiles a tree to LIKE conditions that match the terms anywhere in the text, appending their
+    parameters to args. columns(field) returns the lowercased columns of a field."""
+    if isinstance(node, (Term, Phrase)):
+        text = node.word if isinstance(node, Term) else " ".join(node.words)
+        args.append("%" + re.sub(r"([\\%_])", r"\\\1", text) + "%")
+        return "(" + " OR ".join(f"{column} LIKE ${len(args)}" for column in columns(node.field)) + ")"
+
+    if isinstance(node, Not):
+        return f"NOT {to_like(node.child, columns, args)}"
+
+    if not node.children:
+        return "TRUE" if isinstance(node, And) else "FALSE"
+    return "(" + (" AND " if isinstance(node, And) else " OR ").join(
+        to_like(child, columns, args) for child in node.children) + ")"
@@ -0,0 +1,201 @@
+#  Copyright (c) 2020 Hassan Abouelela
+#  Licensed under the MIT License
+
+"""Benchmarks search, count and read against synthetic article tables of different sizes. (See fakegalnet.py)
+
+Requires a Postgres database. Every size gets its own table (SearchBenchmark_10000, ...), which is seeded
+on the first run and kept with --keep, so later runs can skip the seeding. For every case, the p50 and p95
+latencies, the rows returned, and the peak memory use of the process so far are reported.
+Settings files are written to a temporary directory, so the ones in the current directory are left alone.
+
+Example: python -m python.searchbenchmark --sizes 10000,100000 --repeat 50 --keep
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+
+import asyncpg
+
+from python import articlesearch, extractor, fakegalnet
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+SEARCHES = (
+    ("title", "thargoid"),
+    ("title, multi-word", "thargoid azimuth carrier"),
+    ("content", "--content thargoid"),
+    ("searchall", "--searchall thargoid"),
+    ("searchall, multi-word", "--searchall --limit=20 imperial senator"),
+    ("searchall, dates", "--searchall --after=3301-03-01 --before=3301-09-01 fleet"),
+    ("searchall, reversed", "--searchall --searchreverse fleet"),
+    ("limitall", "--limitall thargoid"),
+    ("limitall, searchall", "--limitall --searchall thargoid"),
+    ("substring", "--substring argo"),
+)
+
+COUNTS = (
+    ("title", "thargoid"),
+    ("all", "--all thargoid"),
+    ("content, after", "--content --after=3301-06-01 fleet"),
+    ("before, no terms", "--before=3302-01-01"),
+)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of the samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def peak_rss() -> str:
+    if resource is None:
+        return "n/a"
+    # Linux reports kilobytes
+    return f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+
+
+def report(name: str, seconds: list, rows: list):
+    print(f"  {name:<32} p50 {percentile(seconds, 0.5) * 1000:8.2f}ms  p95 {percentile(seconds, 0.95) * 1000:8.2f}ms"
+          f"  rows {sum(rows) / len(rows):9.1f}  peak RSS {peak_rss()}")
+
+
+async def time_case(function, arguments: list, repeat: int, cached: bool = False) -> tuple:
+    """Calls function once per argument, after one warm up call, and returns the latencies and rows returned.
+    Unless `cached` is True, the search cache is cleared before every call."""
+    await function(arguments[0])
+
+    seconds, rows = [], []
+    for argument in itertools.islice(itertools.cycle(arguments), repeat):
+        if not cached:
+            (await articlesearch.get_search_cache()).clear()
+        start = time.perf_counter()
+        result = await function(argument)
+        seconds.append(time.perf_counter() - start)
+
+        if isinstance(result, tuple):
+            result = result[0]
+        rows.append(len(result) if isinstance(result, list) else 1)
+    return seconds, rows
+
+
+async def seed(connection: asyncpg.Connection, table: str, size: int, paragraphs: tuple, chunk_size: int = 10000):
+    """Creates a table with `size` synthetic articles, unless one with that many articles is already there.
+    The articles are copied in before the indexes are built, which is much faster than inserting them after."""
+    exists = await connection.fetchval("""
+        SELECT to_regclass($1) IS NOT NULL;
+    """, f'"{table}"')
+    if exists and await connection.fetchval(f"""SELECT COUNT(*) FROM "{table}";""") == size:
+        return False
+
+    await connection.execute(f"""
+        DROP TABLE IF EXISTS "{table}";
+        CREATE TABLE "{table}" (
+        "ID" serial NOT NULL,
+        "Title" text,
+        "UID" text,
+        "dateReleased" date,
+        "dateAdded" date,
+        "Text" text,
+        PRIMARY KEY ("ID"));
+    """)
+
+    date_added = datetime.date.today()
+    articles = fakegalnet.iter_synthetic_articles(size, paragraphs=paragraphs)
+    while True:
+        chunk = [(article.title, article.uid,
+                  extractor.convert_date(datetime.datetime.combine(article.date, datetime.time())),
+                  date_added, article.text.replace("\n", ""))
+                 for article in itertools.islice(articles, chunk_size)]
+        if not chunk:
+            break
+        await connection.copy_records_to_table(table, records=chunk, columns=articlesearch.ARTICLE_COLUMNS)
+
+    await articlesearch.migrate(connection, table)
+    await connection.execute(f"""
+        ANALYZE "{table}";
+    """)
+    return True
+
+
+async def benchmark(options):
+    connection = await asyncpg.connect(host=options.host, port=options.port, user=options.user,
+                                       password=options.password, database=options.database)
+    generator = random.Random(0)
+
+    try:
+        for size in options.sizes:
+            table = f"{options.table}_{size}"
+
+            start = time.perf_counter()
+            if await seed(connection, table, size, (options.min_paragraphs, options.max_paragraphs)):
+                print(f"Seeded {size} articles in {time.perf_counter() - start:.1f}s")
+
+            # search, count and read use the table from Settings.json
+            with open("Settings.json", "w") as settings_file:
+                json.dump(dataclasses.asdict(articlesearch.Settings(
+                    host=options.host, database=options.database, table=table, user=options.user,
+                    password=options.password, port=options.port)), settings_file, indent=2)
+
+            print(f"{table} ({size} articles, {options.repeat} runs per case):")
+            for name, terms in SEARCHES:
+                report(f"search: {name}", *await time_case(articlesearch.search, [terms], options.repeat,
+                                                           options.cached))
+            for name, terms in COUNTS:
+                report(f"count: {name}", *await time_case(articlesearch.count, [terms], options.repeat,
+                                                          options.cached))
+
+            ids = [generator.randint(1, size) for _ in range(options.repeat)]
+            uids = [record["UID"] for record in await connection.fetch(f"""
+                SELECT "UID" FROM "{table}" WHERE "ID" = ANY($1);
+            """, ids)]
+            report("read: ID", *await time_case(articlesearch.read, ids, options.repeat))
+            report("read: UID", *await time_case(lambda uid: articlesearch.read(uid=uid), uids, options.repeat))
+
+            if not options.keep:
+                await connection.execute(f"""
+                    DROP TABLE "{table}";
+                """)
+
+    finally:
+        await articlesearch.shutdown()
+        await connection.close()
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Benchmarks search, count and read against synthetic tables.")
+    arguments.add_argument("--host", default="localhost")
+    arguments.add_argument("--port", type=int, default=None)
+    arguments.add_argument("--database", default="postgres")
+    arguments.add_argument("--user", default="postgres")
+    arguments.add_argument("--password", default=None)
+    arguments.add_argument("--table", default="SearchBenchmark", help="Prefix of the benchmark tables")
+    arguments.add_argument("--keep", action="store_true", help="Keep the benchmark tables for later runs")
+
+    arguments.add_argument("--sizes", type=lambda sizes: [int(size) for size in sizes.split(",")],
+                           default=[10000, 100000, 1000000], help="Comma separated numbers of articles")
+    arguments.add_argument("--repeat", type=int, default=20, help="Number of runs per case")
+    arguments.add_argument("--cached", action="store_true", help="Keep the search cache between runs")
+    arguments.add_argument("--min-paragraphs", type=int, default=2, help="Fewest paragraphs in an article")
+    arguments.add_argument("--max-paragraphs", type=int, default=8, help="Most paragraphs in an article")
+    options = arguments.parse_args()
+
+    # search, count and read load Settings.json from the working directory
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            asyncio.get_event_loop().run_until_complete(benchmark(options))
+        finally:
+            os.chdir(working_directory)
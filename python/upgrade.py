@@ -6,11 +6,19 @@ import asyncio
 import datetime
 
 
+def report_progress(step, done, total):
+    print(f"{step}: {done}/{total}")
+
+
 async def clean_up():
     starting_time = datetime.datetime.now()
     print(f"Starting... ({starting_time})")
-    await articlesearch.clean_up()
+    await articlesearch.clean_up(progress=report_progress)
+    await articlesearch.migrate()
+    await articlesearch.shutdown()
     print(f"Done ({datetime.datetime.now()})")
     print(f"Time taken: {datetime.datetime.now() - starting_time}")
+    # The bot caches articles by ID
+    print("Article IDs may have changed. Restart the bot if it is running.")
 
 asyncio.get_event_loop().run_until_complete(clean_up())